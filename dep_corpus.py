@@ -0,0 +1,296 @@
+#!/usr/bin/python
+# coding: utf-8
+
+from __future__ import with_statement
+import os
+import sys
+import argparse
+import numpy as np
+
+
+"""
+A columnar (NumPy) representation of all the dependency files, which can
+be memory-mapped instead of building a DepTree object for every token
+"""
+
+
+class DepCorpus(object):
+    """
+    All the dependency trees of a corpus in flat arrays. Tokens are stored
+    sentence after sentence, and the tokens of sentence `s` are at
+    positions `offsets[s]:offsets[s+1]`, in word order:
+
+    - `heads`: the word index of the head (starting from one, zero being
+      ROOT), or -1 if the token has no head
+    - `relations`: the id of the relation label to the head, or -1
+    - `tokens`: the id of the word, or -1 if the token is not in the tree
+
+    The sentences of document `d` are `doc_offsets[d]:doc_offsets[d+1]`.
+
+    >>> corpus = DepCorpus.build('./data/dep-files')
+    >>> root = corpus.sentence('APW20001001.2021.0521', 3)
+    >>> egypt = root.get(2)
+    >>> egypt, egypt.relation, egypt.parent
+    (DepNode<Egypt>, 'nsubj', DepNode<_>)
+    >>> egypt.left()
+    [DepNode<CAIRO>, DepNode<,>]
+    >>> egypt.right()
+    [DepNode<AP>]
+    >>> egypt.lca(root.get(10))
+    DepNode<_>
+    """
+
+    def __init__(self, heads, relations, tokens, offsets, doc_offsets,
+                 token_vocab, relation_vocab, filenames):
+        self.heads = heads
+        self.relations = relations
+        self.tokens = tokens
+        self.offsets = offsets
+        self.doc_offsets = doc_offsets
+        self.token_vocab = token_vocab
+        self.relation_vocab = relation_vocab
+        self.filenames = filenames
+        self._doc_ids = dict((x, i) for i, x in enumerate(filenames))
+
+    def __len__(self):
+        """number of sentences"""
+        return len(self.offsets) - 1
+
+    def sentence_id(self, filename, sent_index):
+        """-> the corpus-wide id of a sentence of a document"""
+        d = self._doc_ids[filename]
+        s = self.doc_offsets[d] + sent_index
+        assert s < self.doc_offsets[d + 1]
+        return int(s)
+
+    def sentence(self, filename, sent_index):
+        """-> the ROOT node of a sentence of a document"""
+        return DepNode(self, self.sentence_id(filename, sent_index), 0)
+
+    @classmethod
+    def build(cls, dependency='./data/dep-files'):
+        """
+        Read all the dependency files of a folder (Stanford Parser format)
+        """
+        heads, relations, tokens = list(), list(), list()
+        offsets, doc_offsets = [0], [0]
+        token_vocab, relation_vocab = dict(), dict()
+        filenames = list()
+        for filename in sorted(os.listdir(dependency)):
+            if not filename.endswith('.parse.dep'):
+                continue
+            filenames.append(filename[:21])
+            with open(os.path.join(dependency, filename)) as f:
+                sents = [x for x in f.read().strip().split('\n\n') if x.strip()]
+            for sent in sents:
+                arcs = dict()
+                for line in sent.strip().split('\n'):
+                    relation = line[:line.find('(')]
+                    parent, child = line[line.find('(') + 1: -1].split(', ')
+                    parent_token, parent_index = _split_token(parent)
+                    child_token, child_index = _split_token(child)
+                    arcs[child_index] = (parent_index, relation, child_token)
+                    if parent_index not in arcs and parent_index > 0:
+                        arcs[parent_index] = (-1, None, parent_token)
+                n = max(arcs) if arcs else 0
+                for i in range(1, n + 1):
+                    head, relation, token = arcs.get(i, (-1, None, None))
+                    heads.append(head)
+                    relations.append(-1 if relation is None else
+                                     relation_vocab.setdefault(
+                                         relation, len(relation_vocab)))
+                    tokens.append(-1 if token is None else
+                                  token_vocab.setdefault(
+                                      token, len(token_vocab)))
+                offsets.append(len(heads))
+            doc_offsets.append(len(offsets) - 1)
+        return cls(np.array(heads, dtype=np.int32),
+                   np.array(relations, dtype=np.int16),
+                   np.array(tokens, dtype=np.int32),
+                   np.array(offsets, dtype=np.int64),
+                   np.array(doc_offsets, dtype=np.int64),
+                   _inverse(token_vocab), _inverse(relation_vocab),
+                   filenames)
+
+    _arrays = ('heads', 'relations', 'tokens', 'offsets', 'doc_offsets')
+    _vocabs = ('token_vocab', 'relation_vocab', 'filenames')
+
+    def save(self, folder):
+        """Save the corpus as .npy arrays and plain text vocabularies"""
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for name in self._arrays:
+            np.save(os.path.join(folder, name + '.npy'), getattr(self, name))
+        for name in self._vocabs:
+            with open(os.path.join(folder, name + '.txt'), 'w') as f:
+                f.write('\n'.join(getattr(self, name)))
+
+    @classmethod
+    def load(cls, folder, mmap_mode='r'):
+        """
+        Load a saved corpus, memory-mapping the arrays unless `mmap_mode`
+        is None
+        """
+        arrays = [np.load(os.path.join(folder, name + '.npy'),
+                          mmap_mode=mmap_mode)
+                  for name in cls._arrays]
+        vocabs = list()
+        for name in cls._vocabs:
+            with open(os.path.join(folder, name + '.txt')) as f:
+                vocabs.append(f.read().split('\n'))
+        return cls(*(arrays + vocabs))
+
+
+class DepNode(object):
+    """
+    A lightweight view of a token (or ROOT, with word index 0) of a
+    DepCorpus sentence, with (a read-only subset of) the DepTree API
+    """
+
+    __slots__ = ('corpus', 'sentence_id', '_index', '_start', '_end')
+
+    def __init__(self, corpus, sentence_id, index):
+        self.corpus = corpus
+        self.sentence_id = sentence_id
+        self._index = index
+        self._start = int(corpus.offsets[sentence_id])
+        self._end = int(corpus.offsets[sentence_id + 1])
+
+    def _node(self, index):
+        return DepNode(self.corpus, self.sentence_id, index)
+
+    def is_root(self):
+        return self._index == 0
+
+    @property
+    def index(self):
+        """the word index, starting from zero (ROOT excluded)"""
+        if self.is_root():
+            return None
+        return self._index - 1
+
+    @property
+    def token(self):
+        if self.is_root():
+            return 'ROOT'
+        token = self.corpus.tokens[self._start + self._index - 1]
+        return None if token < 0 else self.corpus.token_vocab[token]
+
+    @property
+    def relation(self):
+        if self.is_root():
+            return None
+        relation = self.corpus.relations[self._start + self._index - 1]
+        return None if relation < 0 else self.corpus.relation_vocab[relation]
+
+    @property
+    def parent(self):
+        if self.is_root():
+            return None
+        head = self.corpus.heads[self._start + self._index - 1]
+        return None if head < 0 else self._node(int(head))
+
+    @property
+    def children(self):
+        """children, in word order"""
+        heads = self.corpus.heads[self._start:self._end]
+        return [self._node(int(i) + 1)
+                for i in np.flatnonzero(heads == self._index)]
+
+    def left(self):
+        """Subtrees left-arced to this tree"""
+        return [x for x in self.children if x._index < self._index]
+
+    def right(self):
+        """Subtrees right-arced to this tree"""
+        return [x for x in self.children if x._index > self._index]
+
+    def get(self, index):
+        """Get the node of a specific word index in the same sentence"""
+        if not 0 <= index < self._end - self._start:
+            return None
+        if self.corpus.tokens[self._start + index] < 0:
+            return None
+        return self._node(index + 1)
+
+    def subtrees(self):
+        """Traverse all subtrees (pre-order)"""
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            yield tree
+            stack.extend(reversed(tree.children))
+
+    def tokens(self):
+        return [x.token for x in self.subtrees()]
+
+    def _path_to_root(self):
+        heads = self.corpus.heads[self._start:self._end]
+        path = [self._index]
+        while path[-1] > 0 and heads[path[-1] - 1] >= 0:
+            path.append(int(heads[path[-1] - 1]))
+        return path
+
+    def lca(self, t):
+        """
+        get the lowest common ancestor, assuming `self` and `t` are from
+        the same sentence; as with DepTree, ROOT is not considered a
+        common ancestor (None is returned)
+        """
+        assert isinstance(t, DepNode)
+        if self == t:
+            return t
+        ancestors = set(self._path_to_root())
+        ancestors.discard(0)
+        for i in t._path_to_root():
+            if i in ancestors:
+                return self._node(i)
+        return None
+
+    def __eq__(self, other):
+        if not isinstance(other, DepNode):
+            return False
+        return (self.corpus is other.corpus and
+                self.sentence_id == other.sentence_id and
+                self._index == other._index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.sentence_id, self._index))
+
+    def __repr__(self):
+        return "DepNode<{0}>".format(self.token)
+
+
+def _split_token(s):
+    """'word-3' -> ('word', 3)"""
+    _parts = s.split('-')
+    return '-'.join(_parts[:-1]).strip(), int(_parts[-1])
+
+
+def _inverse(vocab):
+    """{value: id} -> [value, ...]"""
+    values = [None] * len(vocab)
+    for value, i in vocab.items():
+        values[i] = value
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the columnar dependency corpus")
+    parser.add_argument('--dependency', help="the dependency files",
+                        default='./data/dep-files')
+    parser.add_argument('--out', help="the output folder",
+                        default='./cache/dep-corpus')
+    args = parser.parse_args()
+    corpus = DepCorpus.build(args.dependency)
+    corpus.save(args.out)
+    sys.stderr.write("{} sentences, {} tokens\n".format(
+        len(corpus), len(corpus.heads)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# coding: utf-8
+
+import numpy as np
+
+
+"""
+A shortest dependency path kernel (Bunescu and Mooney, 2005): the path
+between the heads of the two mentions, through their lowest common
+ancestor, compared position by position
+"""
+
+# the features of each position of a path
+FIELDS = ('word', 'pos', 'cpos', 'netype', 'direction')
+
+# the (position x position) comparisons made at once by `gram_matrix`
+BLOCK_SIZE = 1 << 22
+
+
+def mention_head(mention, sentence):
+    """
+    -> the dependency node heading a mention (the lowest common ancestor
+    of its first and last words), or None if there is none
+    """
+    first = sentence.get(mention.indices[0])
+    last = sentence.get(mention.indices[-1])
+    if first is None or last is None:
+        return None
+    return first.lca(last)
+
+
+def shortest_path(left, right):
+    """
+    -> (the nodes on the path from `left` up to the lowest common ancestor
+    and down to `right`, the direction of each node on the path), or None
+    if the only common ancestor is ROOT
+
+    >>> from dependency_tree import DepTree
+    >>> s = '''poss(dog-2, My-1)
+    ... nsubj(likes-4, dog-2)
+    ... root(ROOT-0, likes-4)
+    ... xcomp(likes-4, eating-5)
+    ... dobj(eating-5, sausage-6)'''
+    >>> tree = DepTree.fromstring(s)
+    >>> shortest_path(tree.get(0), tree.get(5))
+    ([DepTree<My>, DepTree<dog>, DepTree<likes>, DepTree<eating>, DepTree<sausage>], ['up', 'up', 'top', 'down', 'down'])
+    >>> shortest_path(tree.get(3), tree.get(5))
+    ([DepTree<likes>, DepTree<eating>, DepTree<sausage>], ['top', 'down', 'down'])
+    """
+    top = left.lca(right)
+    if top is None:
+        return None
+    up = list()
+    cur = left
+    while cur is not top:
+        up.append(cur)
+        cur = cur.parent
+    down = list()
+    cur = right
+    while cur is not top:
+        down.append(cur)
+        cur = cur.parent
+    down.reverse()
+    nodes = up + [top] + down
+    directions = ['up'] * len(up) + ['top'] + ['down'] * len(down)
+    return nodes, directions
+
+
+class ShortestPathKernel(object):
+    """
+    The value of two paths is the product, over their positions, of the
+    number of features the two paths have in common at that position, and
+    zero if their lengths differ. The features are integer-encoded once
+    per path, so that paths of the same length are compared as arrays.
+
+    >>> kernel = ShortestPathKernel()
+    >>> a = kernel.encode([('his', 'PRP$', 'P', 'PER', 'up'),
+    ...                    ('actions', 'NNS', 'N', None, 'top'),
+    ...                    ('Brcko', 'NNP', 'N', 'GPE', 'down')])
+    >>> b = kernel.encode([('his', 'PRP$', 'P', 'PER', 'up'),
+    ...                    ('arrival', 'NN', 'N', None, 'top'),
+    ...                    ('Beijing', 'NNP', 'N', 'GPE', 'down')])
+    >>> c = kernel.encode([('he', 'PRP', 'P', 'PER', 'top'),
+    ...                    ('Beijing', 'NNP', 'N', 'GPE', 'down')])
+    >>> kernel(a, a), kernel(a, b), kernel(a, c)
+    (125.0, 60.0, 0.0)
+    >>> kernel.gram_matrix([a, b, c, None])
+    array([[125.,  60.,   0.,   0.],
+           [ 60., 125.,   0.,   0.],
+           [  0.,   0.,  25.,   0.],
+           [  0.,   0.,   0.,   0.]])
+    """
+
+    def __init__(self):
+        self.vocabularies = [dict() for _ in FIELDS]
+
+    def encode(self, positions):
+        """-> the (positions x FIELDS) integer array of a path"""
+        return np.array([[v.setdefault(x, len(v))
+                          for v, x in zip(self.vocabularies, position)]
+                         for position in positions], dtype=np.int32)
+
+    def path(self, mentionpair, documents):
+        """
+        -> the encoded shortest path between the heads of the mentions of
+        a MentionPair, or None if they are not connected
+        """
+        document = documents[mentionpair.filename]
+        sent_index = mentionpair.left.sent_index
+        sentence = document.dep_sents[sent_index]
+        index = document.span_indices[sent_index]
+        left = mention_head(mentionpair.left, sentence)
+        right = mention_head(mentionpair.right, sentence)
+        if left is None or right is None:
+            return None
+        path = shortest_path(left, right)
+        if path is None:
+            return None
+        if left is right:
+            # both mentions have the same head: it has both NE types
+            netypes = {left: (mentionpair.left.netype,
+                              mentionpair.right.netype)}
+        else:
+            netypes = {left: mentionpair.left.netype,
+                       right: mentionpair.right.netype}
+        positions = list()
+        for node, direction in zip(*path):
+            pos = index.pos(node.index)[1]
+            positions.append((node.token.lower(), pos, pos[0],
+                              netypes.get(node), direction))
+        return self.encode(positions)
+
+    def __call__(self, a, b):
+        """kernel of two encoded paths (0.0 if any is None)"""
+        if a is None or b is None or len(a) != len(b):
+            return 0.0
+        return float(np.prod((a == b).sum(1), dtype=np.float64))
+
+    def gram_matrix(self, paths_x, paths_y=None):
+        """
+        -> the kernel values of paths_x (rows) with paths_y (columns), or
+        of paths_x with themselves; only the paths of the same length are
+        compared, a block of rows at a time
+        """
+        if paths_y is None:
+            paths_y = paths_x
+        gram = np.zeros((len(paths_x), len(paths_y)))
+        groups_y = _by_length(paths_y)
+        for length, rows in _by_length(paths_x).iteritems():
+            cols = groups_y.get(length)
+            if cols is None:
+                continue
+            x = np.array([paths_x[i] for i in rows])
+            y = np.array([paths_y[j] for j in cols])
+            step = max(1, BLOCK_SIZE // (len(cols) * length * len(FIELDS)))
+            for r in range(0, len(rows), step):
+                # (rows, columns, positions) counts of common features
+                common = (x[r:r + step, np.newaxis] == y[np.newaxis]).sum(3)
+                gram[np.ix_(rows[r:r + step], cols)] = \
+                    common.prod(2, dtype=np.float64)
+        return gram
+
+
+def _by_length(paths):
+    """-> {path length: indices of the paths of that length}"""
+    groups = dict()
+    for i, path in enumerate(paths):
+        if path is not None:
+            groups.setdefault(len(path), list()).append(i)
+    return groups
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -30,14 +30,31 @@ class DepTree(object):
     >>> sausage = tree.get(5)
     >>> dog.lca(sausage)
     DepTree<likes>
+    >>> dog.get(0)
+    DepTree<My>
+    >>> print dog.get(3)
+    None
+    >>> dog.path_length(sausage)
+    3
+    >>> tree.lca_batch([(0, 5), (4, 5), (1, 2)])
+    [DepTree<likes>, DepTree<eating>, DepTree<likes>]
     """
 
+    __slots__ = ('token', '_children', '_parent', '_index', '_nodes',
+                 '_depth', '_up', 'features', 'netypes')
+
     def __init__(self, token, index=None):
         self.token = token
         self._children = list()
         self._parent = None
         self._index = index
+        # word index -> node table, only kept by the root of a sentence
+        self._nodes = None
+        # depth and 2^k-th ancestors (binary lifting), set by fromstring
+        self._depth = None
+        self._up = None
         self.features = None
+        self.netypes = None
 
     def is_root(self):
         return self._parent is None
@@ -53,17 +70,20 @@ class DepTree(object):
 
     def get(self, index):
         """Get the subtree of a specific word index"""
+        if self._nodes is not None:
+            return self._nodes.get(index)
         for subtree in self.subtrees():
             if subtree.index == index:
                 return subtree
         return None
 
     def subtrees(self):
-        """Recursively traverse all subtrees"""
-        yield self
-        for child in self.children:
-            for subtree in child.subtrees():
-                yield subtree
+        """Traverse all subtrees (pre-order)"""
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            yield tree
+            stack.extend(reversed(tree._children))
 
     def tokens(self):
         return [x.token for x in self.subtrees()]
@@ -115,6 +135,11 @@ class DepTree(object):
         assert isinstance(t, DepTree)
         if self == t:
             return t
+        if self._up is not None and t._up is not None:
+            cur = self._lowest_common_ancestor(t)
+            if cur is not None:
+                # the ROOT node is not considered a common ancestor
+                return None if cur.is_root() else cur
         path_to_root = set()
         cur = self
         while not cur.is_root():
@@ -127,13 +152,75 @@ class DepTree(object):
             cur = cur.parent
         return cur
 
+    def _lowest_common_ancestor(self, t):
+        """
+        The lowest common ancestor (ROOT included) by binary lifting,
+        or None if `self` and `t` are not in the same tree
+        """
+        a, b = self, t
+        if a._depth < b._depth:
+            a, b = b, a
+        diff = a._depth - b._depth
+        k = 0
+        while diff:
+            if diff & 1:
+                a = a._up[k]
+            diff >>= 1
+            k += 1
+        if a is b:
+            return a
+        for k in reversed(range(len(a._up))):
+            if k < len(a._up) and a._up[k] is not b._up[k]:
+                a, b = a._up[k], b._up[k]
+        return a._parent if a._parent is b._parent else None
+
+    def path_length(self, t):
+        """
+        -> number of arcs on the path between `self` and `t`,
+        assuming they are from the same sentence
+        """
+        assert isinstance(t, DepTree)
+        lca = self._lowest_common_ancestor(t)
+        assert lca is not None
+        return self._depth + t._depth - 2 * lca._depth
+
+    def lca_batch(self, pairs):
+        """
+        -> the `lca` of each pair of word indices in `pairs`,
+        to be called on the root of a sentence
+        """
+        get = self.get
+        return [get(i).lca(get(j)) for i, j in pairs]
+
+    def _index_sentence(self):
+        """
+        Build the word index -> node table and the depth/ancestor tables
+        of a whole sentence, to be called on its root
+        """
+        self._nodes = dict()
+        self._depth = 0
+        self._up = []
+        for node in self.subtrees():
+            if node is self:
+                continue
+            if node.index not in self._nodes:
+                self._nodes[node.index] = node
+            # parents are always visited before their children
+            node._depth = node._parent._depth + 1
+            up = [node._parent]
+            while len(up[-1]._up) >= len(up):
+                up.append(up[-1]._up[len(up) - 1])
+            node._up = up
+
     def _get_pairs(self):
         pairs = list()
-        for c in self.children:
-            parent = "{0:s}-{1:d}".format(self.token, self._index)
+        stack = [(self, c) for c in reversed(self._children)]
+        while stack:
+            p, c = stack.pop()
+            parent = "{0:s}-{1:d}".format(p.token, p._index)
             child = "{0:s}-{1:d}".format(c.token, c._index)
             pairs.append(parent + ', ' + child)
-            pairs += c._get_pairs()
+            stack.extend((c, x) for x in reversed(c._children))
         return pairs
 
     def __repr__(self):
@@ -164,7 +251,9 @@ class DepTree(object):
                 child_node = cls(child_token, index=int(child_index))
                 leaves[child] = child_node
             leaves[parent].add_child(leaves[child])
-        return leaves['ROOT-0']
+        root = leaves['ROOT-0']
+        root._index_sentence()
+        return root
 
 
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 import os
 from nltk import ParentedTree
 from dependency_tree import DepTree
+from span_index import SpanIndex
 
 
 class Document(object):
@@ -21,16 +22,60 @@ class Document(object):
                  parsed='./data/parsed-files',
                  dependency='./data/dep-files'):
         self.filename = filename
-        postagged_file = os.path.join(postagged, filename+'.tag')
-        parsed_file = os.path.join(parsed, filename+'.parse')
-        dep_file = os.path.join(dependency, filename+'.parse.dep')
+        postagged_file, parsed_file, dep_file = \
+            self.source_files(filename, postagged, parsed, dependency)
         self.tagged_sents = [x.strip() for x in open(postagged_file) if x.strip()]
+        self._split_tagged_sents()
         self.parsed_sents = [ParentedTree.fromstring(x) for x in open(parsed_file) if x.strip()]
+        self.span_indices = [SpanIndex(x) for x in self.parsed_sents]
         self.dep_sents = [DepTree.fromstring(x)
                           for x in open(dep_file).read().strip().split('\n\n')
                           if x.strip()]
         assert len(self.tagged_sents) == len(self.parsed_sents)
 
+    def _split_tagged_sents(self):
+        """
+        Split the tagged sentences once into per-sentence tuples of
+        `word_TAG` tokens, words and POS tags. The strings are interned,
+        so each distinct word or tag is only stored once.
+        `first_fields` and `second_fields` hold `token.split('_')[0]` and
+        `token.split('_')[1]`, which some accessors have always returned
+        instead of the word and the tag; they only differ from `words` and
+        `postags` for tokens that contain underscores (e.g. `__IN`), and
+        are the very same tuples otherwise.
+        """
+        self.tagged_tokens = list()
+        self.words = list()
+        self.postags = list()
+        self.first_fields = list()
+        self.second_fields = list()
+        for sent in self.tagged_sents:
+            tagged = tuple(intern(x) for x in sent.split())
+            words = tuple(intern(x.rpartition('_')[0]) for x in tagged)
+            postags = tuple(intern(x.rpartition('_')[2]) for x in tagged)
+            if any(x.count('_') > 1 for x in tagged):
+                fields = [x.split('_') for x in tagged]
+                first = tuple(intern(x[0]) for x in fields)
+                second = tuple(intern(x[1]) for x in fields)
+            else:
+                first, second = words, postags
+            self.tagged_tokens.append(tagged)
+            self.words.append(words)
+            self.postags.append(postags)
+            self.first_fields.append(first)
+            self.second_fields.append(second)
+
+    @staticmethod
+    def source_files(filename, postagged='./data/postagged-files',
+                     parsed='./data/parsed-files',
+                     dependency='./data/dep-files'):
+        """
+        -> paths to the postagged, parsed and dependency files of a document
+        """
+        return (os.path.join(postagged, filename+'.tag'),
+                os.path.join(parsed, filename+'.parse'),
+                os.path.join(dependency, filename+'.parse.dep'))
+
     def __len__(self):
         return len(self.tagged_sents)
 
@@ -56,9 +101,8 @@ class Mention(object):
         Get the POS tags for this mention
         :param document: preloaded resources
         """
-        postagged_tokens = documents[self.filename].tagged_sents[self.sent_index].split()
-        postags = [postagged_tokens[i].split('_')[-1] for i in self.indices]
-        return postags
+        postags = documents[self.filename].postags[self.sent_index]
+        return [postags[i] for i in self.indices]
         
     def get_previous_token(self, documents):
         """
@@ -68,19 +112,18 @@ class Mention(object):
         if self.indices[0]==0:
             return "None"
         else:
-            postagged_tokens = documents[self.filename].tagged_sents[self.sent_index].split()
-            return postagged_tokens[self.indices[0]-1].split('_')[0]
+            return documents[self.filename].first_fields[self.sent_index][self.indices[0]-1]
 
     def get_next_token(self, documents):
         """
         Get the next token in the sentence
         :param documents: preloaded resources
         """
-        postagged_tokens = documents[self.filename].tagged_sents[self.sent_index].split()
-        if self.indices[-1]==len(postagged_tokens)-1:
+        words = documents[self.filename].first_fields[self.sent_index]
+        if self.indices[-1]==len(words)-1:
             return "None"
         else:            
-            return postagged_tokens[self.indices[-1]+1].split('_')[0]
+            return words[self.indices[-1]+1]
 
     def get_previous_pos(self, documents):
         """
@@ -90,38 +133,32 @@ class Mention(object):
         if self.indices[0]==0:
             return "0"
         else:
-            postagged_tokens = documents[self.filename].tagged_sents[self.sent_index].split()
-            return postagged_tokens[self.indices[0]-1].split('_')[1]
+            return documents[self.filename].second_fields[self.sent_index][self.indices[0]-1]
 
     def get_next_pos(self, documents):
         """
         Get the POS tag of the next token in the sentence
         :param documents: preloaded resources
         """
-        postagged_tokens = documents[self.filename].tagged_sents[self.sent_index].split()
-        if self.indices[-1]==len(postagged_tokens)-1:
+        postags = documents[self.filename].second_fields[self.sent_index]
+        if self.indices[-1]==len(postags)-1:
             return "0"
         else:            
-            return postagged_tokens[self.indices[-1]+1].split('_')[1]
+            return postags[self.indices[-1]+1]
 
     def get_sentence_tokens(self, documents):
         '''
         Get all the tokens of the sentence where the mention occurrs
         :param documents: preloaded resources
         '''
-        postagged_tokens = documents[self.filename].tagged_sents[self.sent_index].split()
-        return ['_'.join(token.split('_')[:-1]) for token in postagged_tokens]
+        return list(documents[self.filename].words[self.sent_index])
 
     def get_tree_dominator(self, documents):
         """
         Get the lowest tree node that dominates this mention
         """
-        tree = documents[self.filename].parsed_sents[self.sent_index]
-        subtree_position = tree.treeposition_spanning_leaves(self.indices[0], self.indices[-1]+1)
-        subtree = tree[subtree_position]
-        if not isinstance(subtree, ParentedTree):
-            return tree[subtree_position[:-1]]
-        return subtree
+        index = documents[self.filename].span_indices[self.sent_index]
+        return index.node(index.spanning(self.indices[0], self.indices[-1]+1))
 
     def get_dep_subtree(self, documents):
         """
@@ -186,18 +223,18 @@ class MentionPair(object):
         
     def between_sequence(self,documents):
         """ get tagged sentence fragment between two mention """
-        postagged_tokens = documents[self.filename].tagged_sents[self.left.sent_index].split()
-        return postagged_tokens[self.left.indices[-1]+1:self.right.indices[0]]
+        tagged_tokens = documents[self.filename].tagged_tokens[self.left.sent_index]
+        return list(tagged_tokens[self.left.indices[-1]+1:self.right.indices[0]])
 
     def between_tokens(self,documents):
         """ get tokens between two mention """
-        for postagged_token in self.between_sequence(documents):
-            yield postagged_token.split('_')[0]
+        words = documents[self.filename].first_fields[self.left.sent_index]
+        return iter(words[self.left.indices[-1]+1:self.right.indices[0]])
             
     def between_tags(self,documents):
         """ get POS tags between two mention """
-        for postagged_token in self.between_sequence(documents):
-            yield postagged_token.split('_')[1]
+        postags = documents[self.filename].second_fields[self.left.sent_index]
+        return iter(postags[self.left.indices[-1]+1:self.right.indices[0]])
 
 if __name__ == '__main__':
     import doctest
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# coding: utf-8
+
+from __future__ import with_statement
+import os
+import gc
+import sys
+import hashlib
+import argparse
+import tempfile
+import cPickle as pickle
+from document import Document
+
+
+"""
+An on-disk cache of fully built Document instances
+"""
+
+# bump this whenever the pickled structure of Document (or of the trees
+# it holds) changes, so that stale cache files are rebuilt
+CACHE_VERSION = 6
+
+
+class DocumentCache(object):
+    """
+    Pickled Document instances, one file per document, keyed by the
+    content hash of the document's three source files. A document is
+    only parsed again when one of its source files has changed.
+
+    >>> import shutil
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> cache = DocumentCache(cache_dir)
+    >>> name = 'APW20001001.2021.0521.head.rel.tokenized.raw'
+    >>> print cache.load(name).tagged_sents[1]
+    Egypt-Assad_RB
+    >>> os.listdir(cache_dir)
+    ['APW20001001.2021.0521.head.rel.tokenized.raw.pickle']
+    >>> print cache.load(name).tagged_sents[1]
+    Egypt-Assad_RB
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> shutil.rmtree(cache_dir)
+    """
+
+    def __init__(self, cache_dir='./cache/documents'):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, filename):
+        return os.path.join(self.cache_dir, filename + '.pickle')
+
+    @staticmethod
+    def key(source_files):
+        """ -> the content hash of the source files """
+        sha = hashlib.sha1(str(CACHE_VERSION))
+        for source_file in source_files:
+            with open(source_file, 'rb') as f:
+                sha.update(f.read())
+        return sha.hexdigest()
+
+    def load(self, filename, postagged='./data/postagged-files',
+             parsed='./data/parsed-files',
+             dependency='./data/dep-files'):
+        """
+        Get a Document from the cache, parsing (and caching) it if it
+        is missing or stale
+        """
+        key = self.key(Document.source_files(filename, postagged,
+                                             parsed, dependency))
+        document = self._read(filename, key)
+        if document is not None:
+            self.hits += 1
+            return document
+        self.misses += 1
+        document = Document(filename, postagged, parsed, dependency)
+        self._write(filename, key, document)
+        return document
+
+    def _read(self, filename, key):
+        try:
+            with open(self._path(filename), 'rb') as f:
+                if pickle.load(f) != key:
+                    return None
+                # unpickling creates a lot of small objects, which would
+                # otherwise trigger many useless garbage collections
+                gc.disable()
+                try:
+                    return pickle.load(f)
+                finally:
+                    gc.enable()
+        except (IOError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError):
+            # (the last two from pickles of classes which have changed)
+            return None
+
+    def _write(self, filename, key, document):
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+        # write to a temporary file first, so that concurrent readers
+        # never see a partially written cache file
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(document, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self._path(filename))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def clear(self):
+        """Remove all the cache files"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pickle'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Warm or clear the cache of parsed documents")
+    parser.add_argument('action', choices=['warm', 'clear'])
+    parser.add_argument('--cache', dest='cache_dir', help="the cache folder",
+                        default='./cache/documents')
+    parser.add_argument('--postagged', default='./data/postagged-files')
+    parser.add_argument('--parsed', default='./data/parsed-files')
+    parser.add_argument('--dependency', default='./data/dep-files')
+    args = parser.parse_args()
+    cache = DocumentCache(args.cache_dir)
+    if args.action == 'clear':
+        cache.clear()
+        return
+    for filename in sorted(os.listdir(args.postagged)):
+        if filename.endswith('.tag'):
+            root_name, _ = os.path.splitext(filename)
+            cache.load(root_name, args.postagged, args.parsed,
+                       args.dependency)
+    sys.stderr.write("{} documents cached, {} rebuilt\n".format(
+        cache.hits + cache.misses, cache.misses))
+
+
+if __name__ == '__main__':
+    main()
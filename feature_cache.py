@@ -0,0 +1,238 @@
+#!/usr/bin/python
+# coding: utf-8
+
+from __future__ import with_statement
+import os
+import sys
+import hashlib
+import inspect
+import tempfile
+import features
+import document_cache
+from util import file_hash, resources_hash
+
+
+"""
+An on-disk cache of feature columns (the output of one feature function
+on one data file), so that runs only differing in a few feature functions
+only compute those
+"""
+
+# bump this to invalidate all the cached columns
+CACHE_VERSION = 1
+
+RESOURCES = ('./lists', './data/postagged-files', './data/parsed-files',
+             './data/dep-files')
+
+
+def _code_names(code):
+    """global names used by a code object and the functions it defines"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+def source_hash(func, namespace=None):
+    """
+    -> hash of the source of a feature function and of the helpers
+    (functions and classes of its module) it depends on
+    """
+    namespace = namespace if namespace is not None else func.func_globals
+    sha = hashlib.sha1()
+    seen = set()
+    todo = [func]
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        try:
+            sha.update(inspect.getsource(obj))
+        except (IOError, TypeError):
+            sha.update(repr(obj))
+        if inspect.isclass(obj):
+            codes = [x.__code__ for x in vars(obj).values()
+                     if inspect.isfunction(x)]
+            # memoized attributes wrap their function
+            codes += [x.func.__code__ for x in vars(obj).values()
+                      if inspect.isfunction(getattr(x, 'func', None))]
+        else:
+            codes = [obj.__code__]
+        for code in codes:
+            for name in sorted(_code_names(code)):
+                dependency = namespace.get(name)
+                if (inspect.isfunction(dependency) or
+                        inspect.isclass(dependency)) and \
+                        getattr(dependency, '__module__', None) == \
+                        func.__module__:
+                    todo.append(dependency)
+    return sha.hexdigest()
+
+
+def _source_file(module):
+    """-> the .py file of a module (rather than its .pyc)"""
+    filename = os.path.abspath(module.__file__)
+    if filename.endswith(('.pyc', '.pyo')) and os.path.exists(filename[:-1]):
+        return filename[:-1]
+    return filename
+
+
+def _project_modules(module):
+    """
+    -> the modules of the project (from the folder of `module`) which
+    `module` uses, directly or through other project modules, itself
+    included
+    """
+    folder = os.path.dirname(_source_file(module))
+    found = dict()
+    todo = [module]
+    while todo:
+        current = todo.pop()
+        if current.__name__ in found:
+            continue
+        found[current.__name__] = current
+        for value in vars(current).values():
+            if inspect.ismodule(value):
+                dependency = value
+            else:
+                # names imported from a module (`from x import y`)
+                dependency = sys.modules.get(
+                    getattr(value, '__module__', None) or '')
+            if getattr(dependency, '__file__', None) and \
+                    os.path.dirname(_source_file(dependency)) == folder:
+                todo.append(dependency)
+    return [found[x] for x in sorted(found)]
+
+
+def modules_hash(module):
+    """
+    -> content hash of the project modules used by a module of feature
+    functions (documents, lexicons, trees...), and of the version of the
+    cached documents; the module itself is left to `source_hash`
+    """
+    sha = hashlib.sha1(str(document_cache.CACHE_VERSION))
+    for dependency in _project_modules(module):
+        if dependency is not module:
+            sha.update(dependency.__name__)
+            file_hash(_source_file(dependency), sha)
+    return sha.hexdigest()
+
+
+class FeatureCache(object):
+    """
+    Feature columns, one text file (one feature string per line) per
+    (feature function, data file, resources) key. The key changes with
+    the source of the function, of its helpers and of the project
+    modules its module uses, so a changed helper module is a miss:
+
+    >>> folder = tempfile.mkdtemp()
+    >>> def write(name, source):
+    ...     with open(os.path.join(folder, name), 'w') as f:
+    ...         f.write(source)
+    >>> write('helper.py', 'def lookup(x):\\n    return True\\n')
+    >>> write('funcs.py', 'from helper import lookup\\n'
+    ...                   'def feature(m):\\n    return str(lookup(m))\\n')
+    >>> sys.path.insert(0, folder)
+    >>> import funcs
+    >>> cache = FeatureCache(folder)
+    >>> cache._resources = 'resources'
+    >>> key = cache.key(funcs.feature, 'data')
+    >>> open(cache._path(key), 'w').close()
+    >>> cache._open(cache.key(funcs.feature, 'data')) is not None
+    True
+    >>> write('helper.py', 'def lookup(x):\\n    return False\\n')
+    >>> cache = FeatureCache(folder)
+    >>> cache._resources = 'resources'
+    >>> cache._open(cache.key(funcs.feature, 'data')) is None
+    True
+    >>> del sys.path[0]
+    """
+
+    def __init__(self, cache_dir='./cache/features'):
+        self.cache_dir = cache_dir
+        self._resources = None
+        self._modules = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, func, data_hash):
+        if self._resources is None:
+            self._resources = resources_hash(RESOURCES)
+        if func.__module__ not in self._modules:
+            self._modules[func.__module__] = \
+                modules_hash(sys.modules[func.__module__])
+        sha = hashlib.sha1(str(CACHE_VERSION))
+        sha.update(func.__name__)
+        sha.update(source_hash(func))
+        sha.update(self._modules[func.__module__])
+        sha.update(data_hash)
+        sha.update(self._resources)
+        return func.__name__ + '.' + sha.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.txt')
+
+    def _open(self, key):
+        """ -> the cached column file, or None """
+        try:
+            return open(self._path(key), 'r')
+        except IOError:
+            return None
+
+    def iter_extract(self, functions, data_file, mentionpairs, jobs=1):
+        """
+        Same as `features.iter_extract`, only computing the columns which
+        are not in the cache. Cached columns are read, and new columns
+        written, one line at a time.
+        """
+        data_hash = file_hash(data_file).hexdigest()
+        keys = [self.key(func, data_hash) for func in functions]
+        cached = [self._open(key) for key in keys]
+        missing = [i for i, x in enumerate(cached) if x is None]
+        position = dict((i, j) for j, i in enumerate(missing))
+        self.hits += len(functions) - len(missing)
+        self.misses += len(missing)
+        sys.stderr.write("feature columns: {} cached, {} computed\n".format(
+            len(functions) - len(missing), len(missing)))
+        if missing and not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+        # new columns are written to temporary files, and only moved into
+        # place once complete
+        written = dict()
+        for i in missing:
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+            written[i] = (tmp, os.fdopen(fd, 'w'))
+        try:
+            rows = features.iter_extract([functions[i] for i in missing],
+                                         mentionpairs, jobs)
+            for mentionpair, computed in rows:
+                row = list()
+                for i, column in enumerate(cached):
+                    if column is None:
+                        value = computed[position[i]]
+                        written[i][1].write(value + '\n')
+                    else:
+                        value = column.readline()
+                        if not value:
+                            raise ValueError("cached feature column {} is "
+                                             "too short".format(keys[i]))
+                        value = value.rstrip('\n')
+                    row.append(value)
+                yield mentionpair, row
+            for i in missing:
+                tmp, f = written.pop(i)
+                f.close()
+                os.rename(tmp, self._path(keys[i]))
+        finally:
+            for column in cached:
+                if column is not None:
+                    column.close()
+            for tmp, f in written.values():
+                f.close()
+                os.remove(tmp)
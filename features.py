@@ -3,11 +3,157 @@
 
 from document import *
 from util import *
+from lexicon import load_lexicons
+from itertools import groupby, izip
+from collections import deque
+from multiprocessing import Pool
+from threading import Semaphore
 import re
-import json
 
 # ######### RESOURCES ##########
 documents = load_documents()
+lexicons = load_lexicons()
+
+###############################
+
+# ######### Shared intermediates ##########
+# Values used by several feature functions are computed once per
+# MentionPair (on first use) and kept on the pair as `feature_context`.
+
+
+class _lazy(object):
+    """A read-only attribute computed on first access, then stored"""
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
+
+
+class MentionContext(object):
+    """
+    Memoized intermediates of a single mention
+    """
+
+    def __init__(self, mention):
+        self.mention = mention
+
+    @_lazy
+    def postags(self):
+        return self.mention.get_postag(documents)
+
+    @_lazy
+    def sentence_tokens(self):
+        return documents[self.mention.filename].words[self.mention.sent_index]
+
+    @_lazy
+    def dominator(self):
+        """node id of the lowest constituent dominating the mention"""
+        index = documents[self.mention.filename].span_indices[self.mention.sent_index]
+        return index.spanning(self.mention.indices[0], self.mention.indices[-1]+1)
+
+    @_lazy
+    def dep_children(self):
+        """tokens of the dependents of the mention's dependency subtree"""
+        self._dep_subtree()
+        return self.dep_children
+
+    @_lazy
+    def dep_head(self):
+        """token of the head of the mention's dependency subtree"""
+        self._dep_subtree()
+        return self.dep_head
+
+    def _dep_subtree(self):
+        # only the tokens are kept, so that the context does not hold on
+        # to the trees of the document
+        tree = self.mention.get_dep_subtree(documents)
+        self.dep_children = [x.token for x in tree.children]
+        self.dep_head = tree.parent.token if tree.parent else None
+
+    @_lazy
+    def word_set(self):
+        """lowercased words of the mention string"""
+        return set(self.mention.string.lower().split('_'))
+
+    @_lazy
+    def title(self):
+        return self.mention.string.istitle()
+
+    @_lazy
+    def social(self):
+        return _social_status(self.mention.string)
+
+    @_lazy
+    def employment(self):
+        return _employment_status(self.mention.string)
+
+    @_lazy
+    def ideology(self):
+        return _ideology_status(self.mention.string)
+
+    @_lazy
+    def part_whole(self):
+        return _part_whole_status(self.mention.string)
+
+    @_lazy
+    def geo(self):
+        return _belong(self.mention.string, 'geo')
+
+
+class PairContext(object):
+    """
+    Memoized intermediates of a MentionPair
+    """
+
+    def __init__(self, mentionpair):
+        self.mentionpair = mentionpair
+        self.left = MentionContext(mentionpair.left)
+        self.right = MentionContext(mentionpair.right)
+
+    @_lazy
+    def token_dist(self):
+        return self.mentionpair.right.indices[0] - \
+               self.mentionpair.left.indices[-1]
+
+    @_lazy
+    def between_words(self):
+        return _get_between_words(self.mentionpair)
+
+    @_lazy
+    def between_tokens(self):
+        return list(self.mentionpair.between_tokens(documents))
+
+    @_lazy
+    def between_tags(self):
+        return list(self.mentionpair.between_tags(documents))
+
+    @_lazy
+    def between_tag_prefixes(self):
+        """the first two characters of the between tags, space separated"""
+        return ' '.join(tag[:2] for tag in self.between_tags)
+
+    @_lazy
+    def right_is_subset_left(self):
+        return self.right.word_set.issubset(self.left.word_set)
+
+    @_lazy
+    def left_is_subset_right(self):
+        return self.left.word_set.issubset(self.right.word_set)
+
+
+def _context(mentionpair):
+    """ -> the (memoized) PairContext of a mention pair """
+    try:
+        return mentionpair.feature_context
+    except AttributeError:
+        mentionpair.feature_context = PairContext(mentionpair)
+        return mentionpair.feature_context
 
 ###############################
 
@@ -26,12 +172,12 @@ documents = load_documents()
 #References: lecture slides and reading papers
 def entity_title_e1(mentionpair):
     """ check if left entity mention is titled """
-    return "title_e1=" + str(mentionpair.left.string.istitle())
+    return "title_e1=" + str(_context(mentionpair).left.title)
     
 
 def entity_title_e2(mentionpair):
     """ check if right entity mention is titled """
-    return "title_e2=" + str(mentionpair.right.string.istitle())
+    return "title_e2=" + str(_context(mentionpair).right.title)
     
     
 def entity_alpha_e1(mentionpair):
@@ -66,13 +212,13 @@ def _normalize_pos(pos):
 
 def entity_pos_e1(mentionpair):
     """ -> normalized POS tag of left entity mention """
-    pos_e1 = mentionpair.left.get_postag(documents)[-1]
+    pos_e1 = _context(mentionpair).left.postags[-1]
     return "pos_e1=" + _normalize_pos(pos_e1) 
 
 
 def entity_pos_e2(mentionpair):
     """ -> normalized POS tag of right entity mention """
-    pos_e2 = mentionpair.right.get_postag(documents)[-1]
+    pos_e2 = _context(mentionpair).right.postags[-1]
     return "pos_e2=" + _normalize_pos(pos_e2)
 
 
@@ -108,8 +254,7 @@ def entity_ppos_e2(mentionpair):
 
 def entity_token_dist(mentionpair):
     """ -> number of tokens between two mentions """
-    token_dist = mentionpair.right.indices[0] - \
-                 mentionpair.left.indices[-1]
+    token_dist = _context(mentionpair).token_dist
     if token_dist < 3:
         return "token_dist=" + str(token_dist)
     elif 3 <= token_dist < 5:
@@ -130,8 +275,8 @@ def _get_between_words(mentionpair):
         return ["NA"]
     left_index = mentionpair.left.indices[-1] + 1
     right_index = mentionpair.right.indices[0]
-    sentence_tokens = mentionpair.left.get_sentence_tokens(documents)
-    btw = sentence_tokens[left_index: right_index]
+    sentence_tokens = _context(mentionpair).left.sentence_tokens
+    btw = list(sentence_tokens[left_index: right_index])
     return btw
 
 def left_words(mentionpair):
@@ -145,8 +290,8 @@ def surrounding(mentionpair):
         before = "NA"
     else:
         i = mentionpair.left.indices[0] - 1
-        before = mentionpair.left.get_sentence_tokens(documents)[i]
-    right_sent = mentionpair.right.get_sentence_tokens(documents)
+        before = _context(mentionpair).left.sentence_tokens[i]
+    right_sent = _context(mentionpair).right.sentence_tokens
     if mentionpair.right.indices[-1] == len(right_sent):
         after = "NA"
     else:
@@ -159,7 +304,7 @@ def combo_type(mentionpair):
                                      mentionpair.right.netype)
 
 def first_between(mentionpair):
-    between = _get_between_words(mentionpair)
+    between = _context(mentionpair).between_words
     if len(between)==0:
         return "FIRST_BETWEEN=NA"
     if len(between)==1:
@@ -167,7 +312,7 @@ def first_between(mentionpair):
     return "FIRST_BETWEEN={}".format(between[0])
 
 def last_between(mentionpair):
-    between = _get_between_words(mentionpair)
+    between = _context(mentionpair).between_words
     if len(between)==0:
         return "LAST_BETWEEN=NA"
     if len(between)==1:
@@ -175,7 +320,7 @@ def last_between(mentionpair):
     return "LAST_BETWEEN={}".format(between[-1])
 
 def other_between(mentionpair):
-    between = _get_between_words(mentionpair)
+    between = _context(mentionpair).between_words
     # print between
     if len(between)>2:
         return "OTHER_BETWEEN={}".format('_'.join(between[1:-1]))
@@ -183,14 +328,10 @@ def other_between(mentionpair):
         return "OTHER_BETWEEN=NA"
 
 def _right_is_subset_left(mentionpair):
-    right_string = set(mentionpair.right.string.lower().split('_'))
-    left_string = set(mentionpair.left.string.lower().split('_'))
-    return right_string.issubset(left_string)
+    return _context(mentionpair).right_is_subset_left
 
 def _left_is_subset_right(mentionpair):
-    right_string = set(mentionpair.right.string.lower().split('_'))
-    left_string = set(mentionpair.left.string.lower().split('_'))
-    return left_string.issubset(right_string)
+    return _context(mentionpair).left_is_subset_right
 
 def netype_plus_right_overlap(mentionpair):
     combo = [mentionpair.left.netype, mentionpair.right.netype]
@@ -207,8 +348,8 @@ def is_overlap(mentionpair):
 
 def combo_mention_level(mentionpair):
     """combination of mention levels"""
-    right_pos = mentionpair.right.get_postag(documents)
-    left_pos = mentionpair.left.get_postag(documents)
+    right_pos = _context(mentionpair).right.postags
+    left_pos = _context(mentionpair).left.postags
     
     if any(tag.startswith('NNP') for tag in right_pos) and any(tag.startswith('NNP') for tag in left_pos):
         return "MENTION_LEVEL_MATCH=NNP"
@@ -228,21 +369,19 @@ def combo_words(mentionpair):
 #https://www.ldc.upenn.edu/sites/www.ldc.upenn.edu/files/english-rdc-v4.3.2.PDF
 def entity_between_possessive(mentionpair):
     """ check if there is 's between two mentions """
-    return "btw_pos=" + str('POS' in list\
-                          (mentionpair.between_tags(documents)))
+    return "btw_pos=" + str('POS' in _context(mentionpair).between_tags)
 
 
 def entity_between_preposition(mentionpair):
     """ check if there is a preposition between two mentions """
-    return "btw_prep=" + str('IN' in list\
-                          (mentionpair.between_tags(documents)))
+    return "btw_prep=" + str('IN' in _context(mentionpair).between_tags)
 
 
 def entity_between_preposition_loc(mentionpair):
     """ check if there is a location preposition between two mentions """
     prep_loc = {'at','on','in'}
     temp = False
-    for token in mentionpair.between_tokens(documents):
+    for token in _context(mentionpair).between_tokens:
         if token in prep_loc:
             temp = True
             break
@@ -251,193 +390,115 @@ def entity_between_preposition_loc(mentionpair):
 
 def entity_premod(mentionpair):
     """ check if there is a PreMod relation between two mentions """
-    if entity_title_e1(mentionpair)=='title_e1=True' and \
-       entity_title_e2(mentionpair)=='title_e2=False' and \
-       entity_token_dist(mentionpair)=='token_dist=1':
+    context = _context(mentionpair)
+    if context.left.title and not context.right.title and \
+       context.token_dist == 1:
         return "premod=True"
     else:
         return "premod=False"
 
 def entity_formulaic(mentionpair):
     """ check if there is a formulaic consruction involving two mentions """
-    temp = ' '.join(tag[:2] for tag in
-                    mentionpair.between_tags(documents))
+    temp = _context(mentionpair).between_tag_prefixes
     return "formulaic=" + str(bool(re.search\
                                    (r', .*NN.* ,',temp)))
 
 def entity_verbal(mentionpair):
     """ check if there is a VB...IN pattern between two mentions """
-    temp = ' '.join(tag[:2] for tag in
-                    mentionpair.between_tags(documents))
+    temp = _context(mentionpair).between_tag_prefixes
     return "formulaic=" + str(bool(re.search\
                                    (r'VB .*IN',temp)))
 
 
-social = dict()
-for line in read_lines('lists/social.txt'):
-    tokens = line.split()
-    social[tokens[0]] = tokens[1:]
-
 def _social_status(mention):
     """ check if mention belong to any social relations """
-    temp = 'NONE'
-    for k in social:
-        for v in social[k]:
-            if v in mention:
-                temp = k
-                break
-        if temp!='NONE':
-            break
-    return temp 
+    return lexicons['social'].first(mention)
 
 def entity_social(mentionpair):
     """ look for potential PER.SOC relations """
     temp = 'NONE'
     if mentionpair.left.netype=='PER' and \
        mentionpair.right.netype=='PER':
-        if _social_status(mentionpair.left.string)!='NONE':
-            temp = _social_status(mentionpair.left.string)
-        elif _social_status(mentionpair.right.string)!='NONE':
-            temp = _social_status(mentionpair.right.string)
+        context = _context(mentionpair)
+        if context.left.social!='NONE':
+            temp = context.left.social
+        elif context.right.social!='NONE':
+            temp = context.right.social
     return "social=" + temp
 
-# json format lists
-def _load_list(list_file):
-    """ load the external name list into memory """
-    with open(list_file, 'r') as f:
-        words = set(json.load(f))
-        return words
-
-def _belong(mention,list_file):
+def _belong(mention, lexicon):
     """ check if mention belong to list """
-    temp = False
-    for w in _load_list(list_file):
-        if w in mention.lower():
-            temp = True
-            break
-    return temp
+    return mention in lexicons[lexicon]
             
 def entity_geo(mentionpair):
     """ check if mentions are geographical places """
-    geo_e1,geo_e2 = False, False
-    if _belong(mentionpair.left.string,'lists/GPE.txt'):
-        geo_e1 = True
-    if _belong(mentionpair.right.string,'lists/GPE.txt'):
-        geo_e2 = True
+    geo_e1 = _context(mentionpair).left.geo
+    geo_e2 = _context(mentionpair).right.geo
     return "geo=" + str(geo_e1) + '_' + str(geo_e2)
 
 def entity_geo_e1(mentionpair):
     """ check if left mention is geographical place """
-    geo_e1 = False
-    if _belong(mentionpair.left.string,'lists/GPE.txt'):
-        geo_e1 = True
+    geo_e1 = _context(mentionpair).left.geo
     return "geo_e1=" + str(geo_e1)
 
 def entity_geo_e2(mentionpair):
     """ check if right mention is geographical place """
-    geo_e2 = False
-    if _belong(mentionpair.right.string,'lists/GPE.txt'):
-        geo_e2 = True
+    geo_e2 = _context(mentionpair).right.geo
     return "geo_e2=" + str(geo_e2)
 
-employment = dict()
-for line in read_lines('lists/employment.txt'):
-    tokens = line.split()
-    employment[tokens[0]] = tokens[1:]
-
 def _employment_status(mention):
     """ check if mention belong to any employment relations """
-    temp = 'NONE'
-    for k in employment:
-        for v in employment[k]:
-            if v in mention.lower():
-                temp = k
-                break
-        if temp!='NONE':
-            break
-    return temp
+    return lexicons['employment'].first(mention)
 
 def entity_employment_e1(mentionpair):
     """ look for potential PER.SOC relations """
     temp = 'NONE'
     if mentionpair.left.netype=='PER':
-        if _employment_status(mentionpair.left.string)!='NONE':
-            temp = _employment_status(mentionpair.left.string)
+        temp = _context(mentionpair).left.employment
     return "employ_e1=" + temp
 
 def entity_employment_e2(mentionpair):
     """ look for potential PER.SOC relations """
     temp = 'NONE'
     if mentionpair.right.netype=='PER':
-        if _employment_status(mentionpair.right.string)!='NONE':
-            temp = _employment_status(mentionpair.right.string)
+        temp = _context(mentionpair).right.employment
     return "employ_e2=" + temp
 
-ideology = list()
-for line in read_lines('lists/ideology.txt'):
-    tokens = line.split()
-    ideology.extend(tokens)
-
 def _ideology_status(mention):
     """ check if mention belong to any ideology relations """
-    temp = 'NONE'
-    for token in ideology:
-        if token in mention:
-            temp = 'IDEO'
-            break
-    return temp
+    return lexicons['ideology'].first(mention)
 
 def entity_ideology_e1(mentionpair):
     """ look for potential ideology relations """
     temp = 'NONE'
-    token_dist = mentionpair.right.indices[0] - \
-                 mentionpair.left.indices[-1]
-    if token_dist<=3:
-        temp = _ideology_status(mentionpair.left.string)
+    if _context(mentionpair).token_dist<=3:
+        temp = _context(mentionpair).left.ideology
     return "ideo_e1=" + temp
 
 def entity_ideology_e2(mentionpair):
     """ look for potential ideology relations """
     temp = 'NONE'
-    token_dist = mentionpair.right.indices[0] - \
-                 mentionpair.left.indices[-1]
-    if token_dist<=3:
-        temp = _ideology_status(mentionpair.right.string)
+    if _context(mentionpair).token_dist<=3:
+        temp = _context(mentionpair).right.ideology
     return "ideo_e2=" + temp
 
-part_whole = list()
-for line in read_lines('lists/part-whole.txt'):
-    tokens = line.split()
-    part_whole.extend(tokens)
-
 def _part_whole_status(mention):
     """ check if mention belong to any part-whole relations """
-    temp = 'NONE'
-    for token in part_whole:
-        if token in mention.lower():
-            temp = 'PTWL'
-            break
-    return temp
+    return lexicons['part_whole'].first(mention)
 
 def entity_part_whole_e1(mentionpair):
     """ look for potential part-whole relations """
-    return "ptwl_e1=" + _part_whole_status(mentionpair.left.string)
+    return "ptwl_e1=" + _context(mentionpair).left.part_whole
 
 def entity_part_whole_e2(mentionpair):
     """ look for potential part-whole relations """
-    return "ptwl_e2=" + _part_whole_status(mentionpair.right.string)
+    return "ptwl_e2=" + _context(mentionpair).right.part_whole
 
 
 # FEATURES - KERNEL - TREE - SYNTACTIC
 
 
 
-def syntactic_pt(mentionpair):
-    """
-    -> number of common sub-trees of Path-enclosed Tree
-    """
-    
-
 def lca_type(mentionpair):
     """combination of left&right and LCA==(NP|PP|VP)"""
     netypes = "{}_{}".format(mentionpair.left.netype, mentionpair.right.netype)
@@ -445,14 +506,13 @@ def lca_type(mentionpair):
     if mentionpair.left.sent_index != mentionpair.right.sent_index:
         lca = 'NA'
     else:
-        tree = documents[mentionpair.filename].parsed_sents[mentionpair.left.sent_index]
-        lca_pos = tree.treeposition_spanning_leaves(indices[0], indices[-1]+1)
-        tree = tree[lca_pos]
-        if tree.label().startswith("NP"):
+        index = documents[mentionpair.filename].span_indices[mentionpair.left.sent_index]
+        label = index.labels[index.spanning(indices[0], indices[-1]+1)]
+        if label.startswith("NP"):
             lca = "NP"
-        elif tree.label().startswith("VP"):
+        elif label.startswith("VP"):
             lca = "VP"
-        elif tree.label().startswith("PP"):
+        elif label.startswith("PP"):
             lca = "PP"
         else:
             lca = "OTHER"
@@ -463,55 +523,115 @@ def path_between(mentionpair):
     if mentionpair.left.sent_index != mentionpair.right.sent_index:
         path = "NA"
     else:
-        tree = documents[mentionpair.filename].parsed_sents[mentionpair.left.sent_index]
-        l_tree = mentionpair.left.get_tree_dominator(documents)
-        r_tree = mentionpair.right.get_tree_dominator(documents)
-        l_pos = l_tree.treeposition()
-        r_pos = r_tree.treeposition()
-        for i in range(len(min(l_pos, r_pos))):
-            if l_pos[i] != r_pos[i]:
-                break
-        lca = tree[l_pos[:i]]
-        left_path = list()
-        while l_tree != lca:
-            left_path.append(l_tree.label())
-            l_tree = l_tree.parent()
-        right_path = list()
-        while r_tree != lca:
-            right_path.append(r_tree.label())
-            r_tree = r_tree.parent()
-        right_path.reverse()
-        path = '{}>{}<{}'.format('>'.join(left_path), lca.label(), '<'.join(right_path))
+        index = documents[mentionpair.filename].span_indices[mentionpair.left.sent_index]
+        context = _context(mentionpair)
+        left_path, lca, right_path = index.path(context.left.dominator,
+                                                context.right.dominator)
+        path = '{}>{}<{}'.format('>'.join(left_path), index.labels[lca], '<'.join(right_path))
     return "PATH_BTW={}".format(path)
 
 
 # FEATURES - KERNEL _ TREE - DEPENDENCY
-def _dependent(mention):
-    return '_'.join([c.token for c in mention.get_dep_subtree(documents).children])
+def _dependent(context):
+    return '_'.join(context.dep_children)
 
 def dependent_and_netype(mentionpair):
     """combination of netype and dependent word"""
-    left = _dependent(mentionpair.left) + '|' + mentionpair.left.netype
-    right = _dependent(mentionpair.right) + '|' + mentionpair.right.netype
+    context = _context(mentionpair)
+    left = _dependent(context.left) + '|' + mentionpair.left.netype
+    right = _dependent(context.right) + '|' + mentionpair.right.netype
     return "LEFT_DEPNTYPE={} RIGHT_DEPNTYPE={}".format(left, right)
 
-def _dep_surrouding(mention):
+def _dep_surrouding(context):
     """combination of dependent word and head word"""
-    tree = mention.get_dep_subtree(documents)
-    dep = '_'.join([x.token for x in tree.children])
-    if tree.parent:
-        head = tree.parent.token
+    dep = '_'.join(context.dep_children)
+    if context.dep_head is not None:
+        head = context.dep_head
     else:
         head = 'None'
     return "{}|{}".format(dep, head)
 
 def dep_surrounding(mentionpair):
     """combination of head word and dependent word"""
-    left = _dep_surrouding(mentionpair.left)
-    right = _dep_surrouding(mentionpair.right)
+    context = _context(mentionpair)
+    left = _dep_surrouding(context.left)
+    right = _dep_surrouding(context.right)
     return "LEFT_DEP_SRD={} RIGHT_DEP_SRD={}".format(left, right)
 
 
+# ######### Extraction ##########
+
+def _extract_rows(args):
+    """apply all the feature functions on each mention pair of a chunk"""
+    functions, mentionpairs = args
+    rows = list()
+    for mentionpair in mentionpairs:
+        rows.append([func(mentionpair) for func in functions])
+        # the intermediates are not needed once the row is done
+        mentionpair.__dict__.pop('feature_context', None)
+    return rows
+
+
+def iter_extract(functions, mentionpairs, jobs=1, chunks_per_job=4):
+    """
+    Apply the feature functions on the mention pairs, one pair at a time
+    -> an iterator of (mention pair, list of feature strings), in the input
+    order
+
+    :param functions: the feature functions
+    :param mentionpairs: an iterable of MentionPair instances
+    :param jobs: number of worker processes; the pairs are split into
+                 chunks of consecutive pairs from the same document, so
+                 that each worker only loads the documents it needs
+    :param chunks_per_job: how many chunks per worker are read ahead
+    """
+    if not functions:
+        for mentionpair in mentionpairs:
+            yield mentionpair, []
+        return
+    if jobs <= 1:
+        for mentionpair in mentionpairs:
+            yield mentionpair, _extract_rows((functions, [mentionpair]))[0]
+        return
+    # the pool reads its input as fast as it can: each chunk takes a slot,
+    # which is only given back once its rows have been yielded, so that at
+    # most `jobs * chunks_per_job` chunks are in flight
+    slots = Semaphore(jobs * chunks_per_job)
+    pending = deque()
+    stopped = list()
+
+    def chunks():
+        for _, group in groupby(mentionpairs, key=lambda x: x.filename):
+            slots.acquire()
+            if stopped:
+                return
+            chunk = list(group)
+            pending.append(chunk)
+            yield functions, chunk
+
+    pool = Pool(jobs)
+    try:
+        for rows in pool.imap(_extract_rows, chunks()):
+            chunk = pending.popleft()
+            slots.release()
+            for mentionpair, row in izip(chunk, rows):
+                yield mentionpair, row
+    finally:
+        # unblock the pool if it is waiting for a slot
+        stopped.append(True)
+        slots.release()
+        pool.terminate()
+
+
+def extract(functions, mentionpairs, jobs=1):
+    """
+    Apply the feature functions on the mention pairs
+    -> one list of feature strings per mention pair, in the input order
+    (see `iter_extract`)
+    """
+    return [row for _, row in iter_extract(functions, mentionpairs, jobs)]
+
+
 # ##############################
 
 if __name__ == '__main__':
@@ -4,9 +4,11 @@
 from util import *
 import os
 import features
-from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_extraction import DictVectorizer, FeatureHasher
 from sklearn import svm, metrics
 import numpy as np
+from scipy import sparse
+import cPickle as pickle
 import argparse
 import sys
 import os
@@ -52,20 +54,15 @@ def get_features(config_file, kernel_name):
     return feature_functions
 
 
-def kernel_features(data, config_file, kernel_name, output_file):
+def kernel_features(data, config_file, kernel_name, output_file, jobs=1):
     """ write features of a kernel to txt file """
-    output = list()
-    rels = load_mention_pairs(data)
-    for func in get_features(config_file, kernel_name):
-        output.append(map(func, rels))
-    if len(output) == 0:
+    functions = get_features(config_file, kernel_name)
+    if len(functions) == 0:
         return
-    if os.path.isfile(output_file):
-        os.remove(output_file)
-    with open(output_file, 'a') as f:
-        for i in range(len(output[0])):
-            line = ' '.join([col[i] for col in output])
-            f.write(line + '\n')
+    rels = iter_mention_pairs(data)
+    with open(output_file, 'w') as f:
+        for _, row in features.iter_extract(functions, rels, jobs):
+            f.write(' '.join(row) + '\n')
 
 
 def load_features(feature_file):
@@ -80,10 +77,54 @@ def load_features(feature_file):
     return features
 
 
-def convert_features(features):
-    """ convert features to SVM input format """
-    vec = DictVectorizer()
-    return vec.fit_transform(features).toarray()
+def fit_vectorizer(features, hash_bits=None):
+    """
+    -> the vectorizer of the training features: a DictVectorizer fitted on
+    them, or a FeatureHasher of 2 ** hash_bits columns, which hashes every
+    `name=value` feature to a column, so that matrices built from
+    different files share their columns without a vocabulary
+
+    >>> hasher = fit_vectorizer([{'type_e1': 'PER'}, {'type_e1': 'ORG'}], 4)
+    >>> X = hasher.transform([{'type_e1': 'PER'}, {'type_e1': 'ORG'}])
+    >>> X.shape, X.nnz
+    ((2, 16), 2)
+    >>> (hasher.transform([{'type_e1': 'ORG'}]) != X[1]).nnz
+    0
+    """
+    if hash_bits:
+        return FeatureHasher(n_features=2 ** hash_bits, input_type='dict',
+                             alternate_sign=False)
+    return DictVectorizer().fit(features)
+
+
+def save_vectorizer(vectorizer, path):
+    """ persist the vocabulary of the training features """
+    with open(path, 'wb') as f:
+        pickle.dump(vectorizer, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_vectorizer(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_classifier(classifier, path):
+    """ persist the trained classifier """
+    save_vectorizer(classifier, path)
+
+
+def load_classifier(path):
+    return load_vectorizer(path)
+
+
+def convert_features(features, vectorizer):
+    """
+    convert features to SVM input format, in the columns of the
+    (training) vectorizer; features unseen in training are dropped
+
+    -> sparse (CSR) matrix
+    """
+    return vectorizer.transform(features)
 
 
 def load_labels(data):
@@ -95,12 +136,38 @@ def load_labels(data):
 
 
 def kernel_entity(x, y):
-    """ linear kernel for entity kernel features """
+    """
+    linear kernel for entity kernel features, on dense or sparse
+    (binary) feature matrices
+
+    >>> x = sparse.csr_matrix([[1, 0, 1], [0, 1, 0]])
+    >>> kernel_entity(x, x)
+    array([[2, 0],
+           [0, 1]], dtype=uint8)
+    """
+    if sparse.issparse(x) or sparse.issparse(y):
+        x = sparse.csr_matrix(x, dtype=np.uint8)
+        y = sparse.csr_matrix(y, dtype=np.uint8)
+        return (x * y.T).toarray()
     x = x.astype(np.uint8)
     y = y.astype(np.uint8)
     return np.dot(x, y.T)
 
 
+def make_classifier(name):
+    """
+    :param name: 'liblinear' (linear SVM), 'libsvm' (linear kernel SVM,
+                 slower to train) or 'entity' (SVM with `kernel_entity`)
+    """
+    if name == 'liblinear':
+        return svm.LinearSVC()
+    if name == 'libsvm':
+        return svm.SVC(kernel='linear')
+    if name == 'entity':
+        return svm.SVC(kernel=kernel_entity)
+    raise ValueError("unknown classifier: {}".format(name))
+
+
 def main():
     h = "USAGE: \
          ./kernels.py --train data/rel-trainset.gold \
@@ -124,28 +191,55 @@ def main():
                         help="path to the feature config", default='feature.txt')
     parser.add_argument(
         '--task', dest='out_folder', help="specify a folder for the output and logs", default="DummyExperiment")
+    parser.add_argument('--max-documents', dest='max_documents', type=int,
+                        help="maximum number of parsed documents kept in memory",
+                        default=100)
+    parser.add_argument('--jobs', dest='jobs', type=int,
+                        help="number of processes extracting the features",
+                        default=1)
+    parser.add_argument('--hash-bits', dest='hash_bits', type=int,
+                        help="hash the features to 2^bits sparse columns",
+                        default=None)
+    parser.add_argument('--classifier', dest='classifier',
+                        choices=['liblinear', 'libsvm', 'entity'],
+                        help="linear SVM solver, or the entity kernel",
+                        default='liblinear')
+    parser.add_argument('--decode', dest='decode', action='store_true',
+                        help="only classify the test data, with the vectorizer "
+                             "and classifier saved in the (existing) task folder")
     args = parser.parse_args()
-    if os.path.isdir(args.out_folder):
+    features.documents.max_documents = args.max_documents
+    vectorizer_file = os.path.join(args.out_folder, 'vectorizer')
+    classifier_file = os.path.join(args.out_folder, 'classifier')
+    kernel_name = 'entity'
+    start_train = time()
+    if args.decode:
+        if not os.path.isdir(args.out_folder):
+            print "ERROR: task(out_folder) does not exist"
+            exit()
+    elif os.path.isdir(args.out_folder):
         print "ERROR: task(out_folder) already exists"
         exit()
     else:
         os.makedirs(args.out_folder)
-    
-    start_train = time()
-    kernel_name = 'entity'
-    kernel_features(args.trainset, args.feature_config, kernel_name,
-                    args.out_folder+'/feature.train')
-    X_train = convert_features(load_features(args.out_folder+'/feature.train'))
-    y_train = load_labels(args.trainset)
-    # entity kernel
-    #classifier = svm.SVC(kernel=kernel_entity)  # potential MemoryError
-    classifier = svm.SVC(kernel='linear')
-    classifier.fit(X_train, y_train)
-    
+        kernel_features(args.trainset, args.feature_config, kernel_name,
+                        args.out_folder+'/feature.train', args.jobs)
+        train_features = load_features(args.out_folder+'/feature.train')
+        vectorizer = fit_vectorizer(train_features, args.hash_bits)
+        save_vectorizer(vectorizer, vectorizer_file)
+        X_train = convert_features(train_features, vectorizer)
+        y_train = load_labels(args.trainset)
+        classifier = make_classifier(args.classifier)
+        classifier.fit(X_train, y_train)
+        save_classifier(classifier, classifier_file)
+
+    # the test data is always converted with the saved vocabulary
+    vectorizer = load_vectorizer(vectorizer_file)
+    classifier = load_classifier(classifier_file)
     feature_file_test = args.out_folder+'/feature.test'
     kernel_features(args.testset, args.feature_config, kernel_name,
-                    feature_file_test)
-    X_test = convert_features(load_features(feature_file_test))
+                    feature_file_test, args.jobs)
+    X_test = convert_features(load_features(feature_file_test), vectorizer)
     y_test = load_labels(args.testgold)
     start_decode = time()
     predicted = classifier.predict(X_test)
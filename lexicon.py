@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# coding: utf-8
+
+from __future__ import with_statement
+import os
+import json
+from collections import deque
+
+
+"""
+World knowledge lists (`lists/`) compiled into multi-pattern matchers
+"""
+
+
+class Lexicon(object):
+    """
+    A categorized word list compiled into an Aho-Corasick automaton.
+    A mention string hits a category if any of the category's entries
+    occurs in it as a substring, which is exactly what the old
+    `entry in mention` loops in `features.py` computed, but all the
+    entries are matched in a single pass over the string.
+
+    >>> lex = Lexicon({'FAMILY': ['mother', 'son'], 'OTHER': ['friend']})
+    >>> sorted(lex.categories('grandson and his friends'))
+    ['FAMILY', 'OTHER']
+    >>> lex.first('my mother')
+    'FAMILY'
+    >>> lex.first('Mother')
+    'NONE'
+    >>> 'his sons' in lex
+    True
+    >>> lex = Lexicon({'GPE': ['paris', 'texas']}, lowercase=True)
+    >>> lex.first('PARIS')
+    'GPE'
+    """
+
+    def __init__(self, categories, lowercase=False):
+        """
+        :param categories: a dict mapping a category to its entries
+        :param lowercase: whether mention strings are lowercased before
+                          matching (the entries are taken as they are)
+        """
+        self.lowercase = lowercase
+        self._categories = categories
+        # goto function, failure links and (merged) outputs, per state
+        self._goto = [dict()]
+        self._fail = [0]
+        self._out = [frozenset()]
+        for category in self._categories:
+            for entry in self._categories[category]:
+                if entry:
+                    self._add(entry, category)
+        self._build()
+
+    def _add(self, entry, category):
+        state = 0
+        for char in entry:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append(dict())
+                self._fail.append(0)
+                self._out.append(frozenset())
+                self._goto[state][char] = nxt
+            state = nxt
+        self._out[state] = self._out[state] | frozenset([category])
+
+    def _build(self):
+        """Compute failure links breadth first"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] | self._out[self._fail[nxt]]
+
+    def categories(self, mention):
+        """Get the set of categories hit by a mention string"""
+        if self.lowercase:
+            mention = mention.lower()
+        goto, fail, out = self._goto, self._fail, self._out
+        hits = set()
+        state = 0
+        for char in mention:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                hits.update(out[state])
+        return hits
+
+    def first(self, mention, default='NONE'):
+        """
+        Get the first category (in the iteration order of the category
+        table) hit by a mention string, or `default` if there is none
+        """
+        hits = self.categories(mention)
+        for category in self._categories:
+            if category in hits:
+                return category
+        return default
+
+    def __contains__(self, mention):
+        return len(self.categories(mention)) > 0
+
+    def __len__(self):
+        return len(self._categories)
+
+    @classmethod
+    def from_categorized_file(cls, list_file, lowercase=False):
+        """
+        Load a list with one category per line, e.g.
+        FAMILY aunt mother brother ...
+        """
+        categories = dict()
+        with open(list_file, 'r') as f:
+            for line in f:
+                tokens = line.split()
+                if tokens:
+                    categories[tokens[0]] = tokens[1:]
+        return cls(categories, lowercase)
+
+    @classmethod
+    def from_flat_file(cls, list_file, category, lowercase=False):
+        """Load a whitespace separated list as a single category"""
+        with open(list_file, 'r') as f:
+            return cls({category: f.read().split()}, lowercase)
+
+    @classmethod
+    def from_json_file(cls, list_file, category, lowercase=False):
+        """Load a json format list as a single category"""
+        with open(list_file, 'r') as f:
+            entries = [x.encode('utf-8') if isinstance(x, unicode) else x
+                       for x in json.load(f)]
+        return cls({category: entries}, lowercase)
+
+
+def load_lexicons(lists='./lists'):
+    """
+    Load and compile all the world knowledge lists
+    """
+    return {
+        'social': Lexicon.from_categorized_file(
+            os.path.join(lists, 'social.txt')),
+        'employment': Lexicon.from_categorized_file(
+            os.path.join(lists, 'employment.txt'), lowercase=True),
+        'ideology': Lexicon.from_flat_file(
+            os.path.join(lists, 'ideology.txt'), 'IDEO'),
+        'part_whole': Lexicon.from_flat_file(
+            os.path.join(lists, 'part-whole.txt'), 'PTWL', lowercase=True),
+        'geo': Lexicon.from_json_file(
+            os.path.join(lists, 'GPE.txt'), 'GPE', lowercase=True),
+    }
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
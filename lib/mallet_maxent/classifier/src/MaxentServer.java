@@ -0,0 +1,117 @@
+//a long-lived wrapper for the mallet maxent classifier: the models stay
+//loaded, and batches of feature vectors are classified as they are read
+//from stdin, so that the JVM is only started once
+//
+//compile with:
+//    sh mallet-maxent-classifier.sh make lib/mallet_maxent/classifier/src/MaxentServer.java
+//
+//protocol, on stdin:
+//    classify <n> <modelfile>
+//    <n lines, one feature vector per line>
+//the answer, on stdout, is <n> lines in the same format as
+//"MaxentClassifier -classify". "quit" (or the end of stdin) stops the server.
+
+//old Maximum entropy classifier
+import edu.umass.cs.mallet.share.upenn.MaxEntShell;
+import edu.umass.cs.mallet.base.classify.*;
+import edu.umass.cs.mallet.base.types.*;
+
+import java.io.*;
+import java.util.*;
+
+public class MaxentServer{
+
+    //MEMBER VARIABLES
+
+    //the loaded models, by file name
+    protected static Map models = new HashMap();
+
+    //the modification time of the model files when they were loaded
+    protected static Map loaded = new HashMap();
+
+
+    /*
+     * Get a model, only loading it again if its file has changed.
+     */
+    public static Classifier load(String modelFileName)
+	throws IOException, ClassNotFoundException {
+	File modelFile = new File(modelFileName);
+	Long modified = new Long(modelFile.lastModified());
+	if (!modified.equals(loaded.get(modelFileName))){
+	    System.err.println("Loading model (" + modelFileName + ")");
+	    models.put(modelFileName, MaxEntShell.load(modelFile));
+	    loaded.put(modelFileName, modified);
+	}
+	return (Classifier)models.get(modelFileName);
+    }
+
+
+    /*
+     * Classify one feature vector, formatted as MaxentClassifier does.
+     */
+    public static String classify(Classifier model, String line){
+	String [] feature_vector = line.split("\\s+");
+	Classification cl = MaxEntShell.classify(model, feature_vector);
+	// Find the most probable outcome.
+	double best_p = -1.0;
+	int best_i = 0;
+	Labeling lab = cl.getLabeling();
+	LabelAlphabet labels = lab.getLabelAlphabet();
+
+	for (int c = 0; c < labels.size(); c++){
+	    double p_i = lab.value(c);
+	    if (p_i > best_p){
+		best_i = c;
+		best_p = p_i;
+	    }
+	}
+
+	StringBuffer out = new StringBuffer();
+	out.append((String)labels.lookupObject(best_i) + "\t" + best_p);
+	//output the other labels as well
+	for (int c = 0; c < labels.size(); c++){
+	    double p_i = lab.value(c);
+	    if (p_i != best_p){
+		out.append("\t" + (String)labels.lookupObject(c) + "\t" + p_i);
+	    }
+	}
+	out.append(" " + line);
+	return out.toString();
+    }
+
+
+    public static void main(String args[]) {
+
+	try{
+	    BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+	    PrintStream out = new PrintStream(new BufferedOutputStream(System.out), false);
+	    String request = "";
+	    while((request = in.readLine()) != null){
+		String[] parts = request.split(" ", 3);
+		if (parts[0].equals("quit")) break;
+		if (!parts[0].equals("classify") || parts.length != 3){
+		    System.err.println("Bad request (" + request + ")");
+		    System.exit(-1);
+		}
+		int n = Integer.parseInt(parts[1]);
+		Classifier model = load(parts[2]);
+		//the whole batch is read before answering, so that the
+		//client never blocks writing while this blocks writing back
+		String[] answers = new String[n];
+		for (int i = 0; i < n; i++){
+		    answers[i] = classify(model, in.readLine());
+		}
+		for (int i = 0; i < n; i++){
+		    out.println(answers[i]);
+		}
+		out.flush();
+	    }
+	    System.exit(0);
+
+	}catch (Exception e) {
+	    System.err.println(e);
+	    e.printStackTrace();
+	    System.exit(-1);
+	}
+    }
+}
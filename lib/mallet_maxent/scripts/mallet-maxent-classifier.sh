@@ -15,6 +15,11 @@ if [ "$1" = make ]
 then
     shift
     $JAVAC -d $BASEDIR/classifier/classes "$@"
+elif [ "$1" = serve ]
+then
+    # long-lived classifier, reading requests on stdin (see MaxentServer.java)
+    shift
+    $JAVA -mx3000m MaxentServer "$@"
 else 
     $JAVA -mx3000m MaxentClassifier "$@"
     # for cygwin
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# coding: utf-8
+
+from __future__ import with_statement
+import os
+import atexit
+import subprocess
+from distutils.spawn import find_executable
+
+
+"""
+A long-lived Mallet classifier process (`MaxentServer`), which keeps the
+models loaded, so that decoding does not start a JVM every time
+"""
+
+SCRIPT = 'mallet-maxent-classifier.sh'
+SERVER_CLASS = './lib/mallet_maxent/classifier/classes/MaxentServer.class'
+
+# feature vectors sent to the server per request
+BATCH_SIZE = 1000
+
+
+def available():
+    """ -> whether the server is compiled and Java is installed """
+    return os.path.exists(SERVER_CLASS) and \
+        find_executable('java') is not None
+
+
+class MalletDaemon(object):
+    """
+    The server process, talking over its stdin/stdout. Each request is a
+    `classify <n> <modelfile>` line followed by `n` feature vectors, and
+    is answered by `n` lines formatted as `MaxentClassifier -classify`.
+    """
+
+    def __init__(self, script=SCRIPT):
+        self.process = subprocess.Popen(['sh', script, 'serve'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def classify(self, model_file, lines):
+        """
+        :param model_file: the model, loaded by the server on first use
+        :param lines: the feature vectors (lines of `features.test`)
+        -> one output line per feature vector
+        """
+        lines = [x.rstrip('\n') for x in lines]
+        if not lines:
+            return list()
+        self.process.stdin.write('classify {} {}\n'.format(
+            len(lines), os.path.abspath(model_file)))
+        for line in lines:
+            self.process.stdin.write(line + '\n')
+        self.process.stdin.flush()
+        answers = list()
+        for _ in lines:
+            answer = self.process.stdout.readline()
+            if not answer:
+                raise IOError("the Mallet classifier process has exited")
+            answers.append(answer)
+        return answers
+
+    def classify_file(self, model_file, input_file, output,
+                      batch_size=BATCH_SIZE):
+        """
+        Same as `mallet-maxent-classifier.sh -classify`, writing to `output`
+        """
+        batch = list()
+        with open(input_file) as f:
+            for line in f:
+                batch.append(line)
+                if len(batch) == batch_size:
+                    output.writelines(self.classify(model_file, batch))
+                    batch = list()
+        output.writelines(self.classify(model_file, batch))
+
+    def close(self):
+        if self.alive():
+            self.process.stdin.write('quit\n')
+            self.process.stdin.close()
+            self.process.wait()
+
+
+_daemon = None
+
+
+def get_daemon():
+    """ -> the server of this process, started (again) if needed """
+    global _daemon
+    if _daemon is None or not _daemon.alive():
+        if _daemon is None:
+            atexit.register(lambda: _daemon.close())
+        _daemon = MalletDaemon()
+    return _daemon
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# coding: utf-8
+
+from __future__ import with_statement
+import sys
+import argparse
+from time import time
+import numpy as np
+from scipy import sparse
+from scipy.optimize import fmin_l_bfgs_b
+
+
+"""
+A multinomial logistic regression (maximum entropy) classifier over
+sparse binary features, as an in-process alternative to
+`mallet-maxent-classifier.sh`. It reads and writes the same files.
+"""
+
+
+def read_feature_file(feature_file, labeled):
+    """
+    Read a feature file (`features.train`/`features.test`)
+    -> (list of feature lists, list of labels or None, list of lines)
+    """
+    rows, labels, lines = list(), list(), list()
+    with open(feature_file) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            parts = line.split()
+            if labeled:
+                labels.append(parts[0])
+                parts = parts[1:]
+            rows.append(parts)
+            lines.append(line)
+    return rows, (labels if labeled else None), lines
+
+
+class MaxentClassifier(object):
+    """
+    Maximum entropy classifier trained with L-BFGS, with a Gaussian prior
+    (L2 regularization) of variance `variance` on the weights, as the
+    Mallet classifier does. Every distinct feature string is a binary
+    feature, and each label has a bias weight. Training stops after
+    `max_iter` iterations, or once an iteration reduces the loss by less
+    than `tolerance` (relatively). The weights smaller than `prune` are
+    then dropped, and the others kept as a sparse matrix.
+
+    >>> rows = [['a', 'x=1'], ['a', 'x=2'], ['b', 'x=1'], ['b', 'x=2']]
+    >>> clf = MaxentClassifier(variance=10.0).train(rows, ['A', 'A', 'B', 'B'])
+    >>> clf.labels
+    ['A', 'B']
+    >>> [clf.labels[i] for i in clf.predict_proba([['a'], ['b'], ['c']]).argmax(1)]
+    ['A', 'B', 'A']
+    """
+
+    def __init__(self, variance=1.0, max_iter=100, tolerance=1e-5, prune=1e-4):
+        self.variance = variance
+        self.max_iter = max_iter
+        self.tolerance = tolerance
+        self.prune = prune
+        self.labels = list()
+        self.vocabulary = dict()
+        self.weights = None
+        self.bias = None
+
+    def _matrix(self, rows, grow=False):
+        """feature lists -> sparse (instances x features) CSR matrix"""
+        indptr, indices = [0], list()
+        for row in rows:
+            for feature in row:
+                i = self.vocabulary.get(feature)
+                if i is None and grow:
+                    i = self.vocabulary[feature] = len(self.vocabulary)
+                if i is not None:
+                    indices.append(i)
+            indptr.append(len(indices))
+        data = np.ones(len(indices))
+        matrix = sparse.csr_matrix((data, indices, indptr),
+                                   shape=(len(rows), len(self.vocabulary)))
+        # features repeated in a row are counted, as in Mallet
+        matrix.sum_duplicates()
+        return matrix
+
+    def train(self, rows, labels):
+        """
+        :param rows: one list of feature strings per instance
+        :param labels: the label of each instance
+        """
+        label_ids = dict()
+        for label in labels:
+            if label not in label_ids:
+                label_ids[label] = len(label_ids)
+                self.labels.append(label)
+        X = self._matrix(rows, grow=True)
+        XT = X.T.tocsr()
+        y = np.array([label_ids[x] for x in labels])
+        n, d = X.shape
+        k = len(self.labels)
+        Y = sparse.csr_matrix((np.ones(n), (np.arange(n), y)), shape=(n, k))
+        # the feature counts of each label do not change across iterations
+        empirical = np.asarray((XT * Y).todense())
+        empirical_bias = np.asarray(Y.sum(0)).ravel()
+
+        def objective(theta):
+            W = theta[:d * k].reshape(d, k)
+            b = theta[d * k:]
+            scores = X * W + b
+            scores -= scores.max(1)[:, np.newaxis]
+            expected = np.exp(scores)
+            normalizer = expected.sum(1)
+            expected /= normalizer[:, np.newaxis]
+            log_likelihood = scores[np.arange(n), y].sum() - \
+                np.log(normalizer).sum()
+            loss = -log_likelihood + (W ** 2).sum() / (2 * self.variance)
+            grad_W = XT * expected - empirical + W / self.variance
+            grad_b = expected.sum(0) - empirical_bias
+            return loss, np.concatenate([grad_W.ravel(), grad_b])
+
+        theta, _, _ = fmin_l_bfgs_b(objective, np.zeros(d * k + k),
+                                    maxiter=self.max_iter,
+                                    factr=self.tolerance / np.finfo(float).eps)
+        weights = theta[:d * k].reshape(d, k)
+        # most weights only move a little away from zero (features never
+        # seen with a label), and do not change the predictions
+        weights[np.abs(weights) < self.prune] = 0.0
+        self.weights = sparse.csr_matrix(weights)
+        self.bias = theta[d * k:]
+        return self
+
+    def predict_proba(self, rows):
+        """-> (instances x labels) array of probabilities"""
+        scores = (self._matrix(rows) * self.weights).toarray() + self.bias
+        scores -= scores.max(1)[:, np.newaxis]
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(1)[:, np.newaxis]
+        return probabilities
+
+    def save(self, model_file):
+        """ save the model as NumPy arrays (the weights in CSR form) """
+        features = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(model_file, 'wb') as f:
+            np.savez_compressed(f, labels=np.array(self.labels),
+                                features=np.array(features),
+                                data=self.weights.data,
+                                indices=self.weights.indices,
+                                indptr=self.weights.indptr,
+                                shape=self.weights.shape,
+                                bias=self.bias, variance=self.variance)
+
+    @classmethod
+    def load(cls, model_file):
+        with open(model_file, 'rb') as f:
+            arrays = np.load(f)
+            model = cls(float(arrays['variance']))
+            model.labels = arrays['labels'].tolist()
+            model.vocabulary = dict((x, i) for i, x in
+                                    enumerate(arrays['features'].tolist()))
+            model.weights = sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']),
+                shape=tuple(arrays['shape']))
+            model.bias = arrays['bias']
+        return model
+
+
+def train(gold, model_file, variance=1.0):
+    """
+    Train a model on a labeled feature file, and save it
+    """
+    begin = time()
+    rows, labels, _ = read_feature_file(gold, labeled=True)
+    MaxentClassifier(variance).train(rows, labels).save(model_file)
+    sys.stderr.write("Elapsed Time: {:.3f}seconds\n".format(time() - begin))
+
+
+def classify(model_file, input_file, output):
+    """
+    Classify a feature file, writing one line per instance to `output`:
+    the best label and its probability, then the other labels and their
+    probabilities (tab separated), then the input line, as
+    `MaxentClassifier.java` does
+    """
+    model = MaxentClassifier.load(model_file)
+    rows, _, lines = read_feature_file(input_file, labeled=False)
+    if not rows:
+        return
+    probabilities = model.predict_proba(rows)
+    for line, p in zip(lines, probabilities):
+        best = p.argmax()
+        fields = [model.labels[best], repr(p[best])]
+        for c in range(len(model.labels)):
+            if p[c] != p[best]:
+                fields += [model.labels[c], repr(p[c])]
+        output.write('\t'.join(fields) + ' ' + line + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train or apply a maximum entropy classifier")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-train', action='store_true')
+    group.add_argument('-classify', action='store_true')
+    parser.add_argument('-model', required=True, help="the model file")
+    parser.add_argument('-gold', help="the training data")
+    parser.add_argument('-input', help="the data to classify")
+    parser.add_argument('-variance', type=float, default=1.0,
+                        help="variance of the Gaussian prior")
+    args = parser.parse_args()
+    if args.train:
+        train(args.gold, args.model, args.variance)
+    else:
+        classify(args.model, args.input, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
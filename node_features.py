@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# coding: utf-8
+
+from __future__ import with_statement
+import os
+import sys
+import hashlib
+import argparse
+import tempfile
+import cPickle as pickle
+from util import resources_hash
+
+
+"""
+A table of the lexical features of every dependency node of the corpus
+(as used by the tree kernels), built in one pass and kept on disk, so that
+the kernels never query the parse trees
+"""
+
+# bump this whenever `lexical_features` changes
+TABLE_VERSION = 1
+
+SOURCES = ('./data/parsed-files', './data/dep-files')
+
+
+def lexical_features(t, index):
+    """
+    -> (word, POS, Collapsed_POS, ChunkTag, WordNet_Hypernym) of a
+    dependency node. The hypernym is always None: the tree kernels have
+    always looked it up as `wn.synsets(word).hypernyms()[0]`, which fails
+    (`hypernyms` is called on the list of synsets), so WordNet is not
+    queried at all.
+
+    :param t: a DepTree node (not ROOT)
+    :param index: the SpanIndex of the parse tree of its sentence
+    """
+    word = t.token.lower()
+    pos = index.pos(t.index)
+    collapsed = pos[0]
+    # the phrase right above the preterminal
+    chunktag = index.labels[max(index.parents[index.preterminal(t.index)], 0)]
+    if chunktag.startswith("N"): chunktag = 'NP'
+    elif chunktag.startswith("V"): chunktag = "VP"
+    elif chunktag.startswith("P"): chunktag = "VP"
+    else: chunktag = 'OTHER'
+    return (word, pos, collapsed, chunktag, None)
+
+
+class NodeFeatureTable(object):
+    """
+    The lexical features of the dependency nodes, by (filename, sentence
+    index, word index)
+
+    >>> from util import load_documents
+    >>> documents = load_documents()
+    >>> table = NodeFeatureTable.build(documents, ['APW20001001.2021.0521'])
+    >>> t = documents['APW20001001.2021.0521'].dep_sents[3].get(2)
+    >>> table.get(t, 3, 'APW20001001.2021.0521')
+    ('egypt', ('Egypt', 'NNP'), 'Egypt', 'NP', None)
+    """
+
+    def __init__(self, rows=None):
+        self.rows = rows if rows is not None else dict()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, t, sent_index, filename):
+        """-> the lexical features of a node, or None if it is missing"""
+        return self.rows.get((filename, sent_index, t.index))
+
+    @classmethod
+    def build(cls, documents, filenames=None):
+        """
+        Compute the features of every node of the documents (or of
+        `filenames` only)
+        """
+        rows = dict()
+        for filename in (filenames if filenames is not None else documents):
+            document = documents[filename]
+            for sent_index, sentence in enumerate(document.dep_sents):
+                index = document.span_indices[sent_index]
+                for t in sentence.subtrees():
+                    if t.is_root():
+                        continue
+                    try:
+                        row = lexical_features(t, index)
+                    except Exception:
+                        # nodes which do not line up with the parse tree
+                        # are left to the kernel, which fails on them
+                        continue
+                    rows[filename, sent_index, t.index] = row
+        return cls(rows)
+
+    @staticmethod
+    def key(sources=SOURCES):
+        """ -> the hash of the table version and of the source files """
+        sha = hashlib.sha1(str(TABLE_VERSION))
+        sha.update(resources_hash(sources))
+        return sha.hexdigest()
+
+    def save(self, path, key):
+        folder = os.path.dirname(path) or '.'
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        fd, tmp = tempfile.mkstemp(dir=folder)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self.rows, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, key):
+        """ -> the saved table, or None if it is missing or stale """
+        try:
+            with open(path, 'rb') as f:
+                if pickle.load(f) != key:
+                    return None
+                return cls(pickle.load(f))
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+
+def load_node_features(documents, path='./cache/node-features.pickle'):
+    """
+    -> the NodeFeatureTable of the corpus, built and saved if needed
+    """
+    key = NodeFeatureTable.key()
+    table = NodeFeatureTable.load(path, key)
+    if table is None:
+        table = NodeFeatureTable.build(documents)
+        table.save(path, key)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the lexical feature table of the tree kernels")
+    parser.add_argument('--out', help="the table file",
+                        default='./cache/node-features.pickle')
+    args = parser.parse_args()
+    from util import load_documents
+    table = NodeFeatureTable.build(load_documents())
+    table.save(args.out, NodeFeatureTable.key())
+    sys.stderr.write("{} nodes\n".format(len(table)))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,14 @@ import sys
 import argparse
 from time import time
 import features
+import maxent
+import mallet_daemon
+from feature_cache import FeatureCache
 from util import *
 
+# how often (in mention pairs) the extraction throughput is reported
+PROGRESS_EVERY = 10000
+
 
 def load_functions(feature_config):
     """
@@ -24,7 +30,8 @@ def load_functions(feature_config):
     return feature_functions
 
 
-def apply_features(feat_config, data, out_folder, train):
+def apply_features(feat_config, data, out_folder, train, jobs=1,
+                   cache_dir=None):
     """
     apply all feature functions on the input and generate the training
     file
@@ -34,44 +41,86 @@ def apply_features(feat_config, data, out_folder, train):
     :param data: the data you want to apply feature functions on. e.g. "coref-trainset.gold"
     :param out_folder: where you want to store the extracted features. e.g. "MyDummyExperiment"
     :param train: whether the input data contains gold tags
+    :param jobs: number of processes extracting the features
+    :param cache_dir: where to cache the feature columns (None for no cache)
     """
-    result = list()
-    data = load_mention_pairs(data)
     if train:
-        result.append([x.label for x in data])
         outf = os.path.join(out_folder, "features.train")
     else:
         outf = os.path.join(out_folder, "features.test")
-    for func in load_functions(feat_config):
-        result.append(map(func, data))
-    if len(result) == 0:
+    functions = load_functions(feat_config)
+    if not train and len(functions) == 0:
         return
-    with open(outf, 'a') as f:
-        for i in range(len(result[0])):
-            line = ' '.join([col[i] for col in result])
-            f.write(line + '\n')
-
-
-def train(features, data, out_folder):
+    # mention pairs are read, and their features written, one at a time
+    mentionpairs = iter_mention_pairs(data)
+    if cache_dir:
+        rows = FeatureCache(cache_dir).iter_extract(functions, data,
+                                                    mentionpairs, jobs)
+    else:
+        rows = features.iter_extract(functions, mentionpairs, jobs)
+    start = time()
+    count = 0
+    with open(outf, 'w') as f:
+        for mentionpair, row in rows:
+            if train:
+                row = [mentionpair.label] + row
+            f.write(' '.join(row) + '\n')
+            count += 1
+            if count % PROGRESS_EVERY == 0:
+                _progress(count, start)
+    _progress(count, start)
+
+
+def _progress(count, start):
+    """ report the feature extraction throughput """
+    elapsed = time() - start
+    sys.stderr.write("{} mention pairs, {:.1f} pairs/sec\n".format(
+        count, count / elapsed if elapsed > 0 else 0.0))
+
+
+def train(features, data, out_folder, jobs=1, cache_dir=None,
+          classifier='mallet'):
     """
     Train with specified threads and output folder
 
     :param features: the feature functions
     :param out_folder: the output directory of the model
     :param data: the input training data
+    :param jobs: number of processes extracting the features
+    :param cache_dir: where to cache the feature columns
+    :param classifier: 'mallet', or 'maxent' for the in-process trainer
     """
-    apply_features(features, data, out_folder, train=True)
+    apply_features(features, data, out_folder, train=True, jobs=jobs,
+                   cache_dir=cache_dir)
+    if classifier == 'maxent':
+        maxent.train(os.path.join(out_folder, 'features.train'),
+                     os.path.join(out_folder, 'trained.model'))
+        return
     cmd = "sh mallet-maxent-classifier.sh -train -model=%s -gold=%s" % \
           (os.path.join(out_folder, 'trained.model'),
            os.path.join(out_folder, 'features.train'))
     os.system(cmd)
 
 
-def decode(features, data, out_folder):
+def decode(features, data, out_folder, jobs=1, cache_dir=None,
+           classifier='mallet'):
     """
     Get the hypothesis on test data
     """
-    apply_features(features, data, out_folder, train=False)
+    apply_features(features, data, out_folder, train=False, jobs=jobs,
+                   cache_dir=cache_dir)
+    if classifier == 'maxent':
+        with open(os.path.join(out_folder, 'hypothesis.prob'), 'w') as f:
+            maxent.classify(os.path.join(out_folder, 'trained.model'),
+                            os.path.join(out_folder, 'features.test'), f)
+        return
+    if mallet_daemon.available():
+        # a resident classifier process saves a JVM start per decode
+        with open(os.path.join(out_folder, 'hypothesis.prob'), 'w') as f:
+            mallet_daemon.get_daemon().classify_file(
+                os.path.join(out_folder, 'trained.model'),
+                os.path.join(out_folder, 'features.test'), f)
+        return
     cmd = 'sh mallet-maxent-classifier.sh -classify -model={0:s} -input={1:s} > {2:s}' \
         .format(os.path.join(out_folder, 'trained.model'),
                 os.path.join(out_folder, 'features.test'),
@@ -133,16 +182,32 @@ def main():
                         help="path to the feature config", default='A')
     parser.add_argument(
         '--task', dest='out_folder', help="specify a folder for the output and logs")
+    parser.add_argument('--max-documents', dest='max_documents', type=int,
+                        help="maximum number of parsed documents kept in memory",
+                        default=100)
+    parser.add_argument('--jobs', dest='jobs', type=int,
+                        help="number of processes extracting the features",
+                        default=1)
+    parser.add_argument('--feature-cache', dest='feature_cache',
+                        help="folder caching the feature columns ('' for none)",
+                        default='./cache/features')
+    parser.add_argument('--classifier', dest='classifier',
+                        choices=['mallet', 'maxent'],
+                        help="Mallet (through Java), or the in-process maxent",
+                        default='mallet')
     args = parser.parse_args()
+    features.documents.max_documents = args.max_documents
     if os.path.isdir(args.out_folder):
         print "ERROR: task(out_folder) already exists"
         exit()
     else:
         os.makedirs(args.out_folder)
     start_train = time()
-    train(args.feature_config, args.trainset, args.out_folder)
+    train(args.feature_config, args.trainset, args.out_folder, args.jobs,
+          args.feature_cache, args.classifier)
     start_decode = time()
-    decode(args.feature_config, args.testset, args.out_folder)
+    decode(args.feature_config, args.testset, args.out_folder, args.jobs,
+           args.feature_cache, args.classifier)
     start_eval = time()
     precision, recall, f = evaluate(args.testgold, args.out_folder)
     time_consumption = "Training: %.2f sec\nDecoding: %.2f sec" % \
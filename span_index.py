@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# coding: utf-8
+
+from nltk import Tree
+
+
+"""
+Flat lookup tables over a constituency tree, for span and path queries
+"""
+
+
+class SpanIndex(object):
+    """
+    The nodes of a parse tree numbered in pre-order (the root is 0), with
+    their labels, parents, depths and tree positions in flat lists, and
+    the preterminal node of every leaf.
+
+    >>> from nltk import ParentedTree
+    >>> tree = ParentedTree.fromstring(
+    ...     "(S (NP (D the) (N dog)) (VP (V chased) (NP (D the) (N cat))))")
+    >>> index = SpanIndex(tree)
+    >>> index.treeposition_spanning_leaves(1, 4)
+    ()
+    >>> index.treeposition_spanning_leaves(3, 5)
+    (1, 1)
+    >>> index.treeposition_spanning_leaves(2, 3)
+    (1, 0, 0)
+    >>> index.pos(4)
+    ('cat', 'N')
+    >>> print index.node(index.spanning(0, 2))
+    (NP (D the) (N dog))
+    >>> index.path(index.spanning(0, 2), index.spanning(4, 5))
+    (['NP'], 0, ['VP', 'NP', 'N'])
+    >>> index.children(0), index.leaf_span(index.spanning(3, 5))
+    ([1, 4], (3, 5))
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.labels = list()
+        self.parents = list()
+        self.depths = list()
+        self.positions = list()
+        self.leaves = list()
+        self.leaf_parents = list()
+        self.leaf_positions = list()
+        self._spans = dict()
+        self._children = None
+        self._leaf_spans = None
+        stack = [(tree, -1, ())]
+        while stack:
+            node, parent, position = stack.pop()
+            if not isinstance(node, Tree):
+                self.leaves.append(node)
+                self.leaf_parents.append(parent)
+                self.leaf_positions.append(position)
+                continue
+            k = len(self.labels)
+            self.labels.append(node.label())
+            self.parents.append(parent)
+            self.depths.append(0 if parent < 0 else self.depths[parent] + 1)
+            self.positions.append(position)
+            for i in reversed(range(len(node))):
+                stack.append((node[i], k, position + (i,)))
+
+    def node(self, k):
+        """-> the subtree of node `k`"""
+        return self.tree[self.positions[k]]
+
+    def preterminal(self, i):
+        """-> the node directly above leaf `i`"""
+        return self.leaf_parents[i]
+
+    def pos(self, i):
+        """-> (word, POS tag) of leaf `i`, as `tree.pos()[i]`"""
+        return (self.leaves[i], self.labels[self.leaf_parents[i]])
+
+    def lca(self, a, b):
+        """-> the lowest common ancestor (or self) of nodes `a` and `b`"""
+        depths, parents = self.depths, self.parents
+        while depths[a] > depths[b]:
+            a = parents[a]
+        while depths[b] > depths[a]:
+            b = parents[b]
+        while a != b:
+            a, b = parents[a], parents[b]
+        return a
+
+    def spanning(self, start, end):
+        """
+        -> the lowest node dominating leaves `start` to `end` (excluded);
+        the preterminal if this is a single leaf
+        """
+        if end <= start:
+            raise ValueError('end must be greater than start')
+        try:
+            return self._spans[start, end]
+        except KeyError:
+            k = self.lca(self.leaf_parents[start], self.leaf_parents[end - 1])
+            self._spans[start, end] = k
+            return k
+
+    def treeposition_spanning_leaves(self, start, end):
+        """
+        Same as `Tree.treeposition_spanning_leaves`: the position of the
+        spanning node, or of the leaf itself for a single leaf
+        """
+        if end - start == 1:
+            return self.leaf_positions[start]
+        return self.positions[self.spanning(start, end)]
+
+    def path(self, a, b):
+        """
+        -> (labels from `a` up to the lca, lca, labels from the lca down to
+        `b`), both label lists excluding the lca. If one node dominates the
+        other, the parent of the dominating one is taken as the lca, which
+        is what `features.path_between` has always done
+        """
+        lca = self.lca(a, b)
+        if lca == a or lca == b:
+            lca = max(self.parents[lca], 0)
+        left = list()
+        while a != lca:
+            left.append(self.labels[a])
+            a = self.parents[a]
+        right = list()
+        while b != lca:
+            right.append(self.labels[b])
+            b = self.parents[b]
+        right.reverse()
+        return left, lca, right
+
+    def _structure(self):
+        """build the child lists and the leaf spans of the nodes"""
+        children = [list() for _ in self.labels]
+        for k in range(1, len(self.labels)):
+            children[self.parents[k]].append(k)
+        first = [len(self.leaves)] * len(self.labels)
+        end = [0] * len(self.labels)
+        for i, k in enumerate(self.leaf_parents):
+            first[k] = min(first[k], i)
+            end[k] = max(end[k], i + 1)
+        # children come after their parent in pre-order
+        for k in reversed(range(1, len(self.labels))):
+            p = self.parents[k]
+            first[p] = min(first[p], first[k])
+            end[p] = max(end[p], end[k])
+        self._children = children
+        self._leaf_spans = zip(first, end)
+
+    def children(self, k):
+        """-> the child nodes of node `k` (not its leaves), left to right"""
+        if self._children is None:
+            self._structure()
+        return self._children[k]
+
+    def leaf_span(self, k):
+        """-> (first leaf, last leaf + 1) of node `k`"""
+        if self._leaf_spans is None:
+            self._structure()
+        return self._leaf_spans[k]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_spans'] = dict()
+        state['_children'] = None
+        state['_leaf_spans'] = None
+        return state
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# coding: utf-8
+
+import argparse
+import numpy as np
+
+
+"""
+A gap-weighted subsequence kernel (Lodhi et al., 2002; Bunescu and Mooney,
+2005) over the words between two mentions and a window around them,
+computed for batches of sequence pairs at once with NumPy
+"""
+
+# the (pair x position x position) cells computed at once
+BLOCK_SIZE = 1 << 18
+
+# the rows of the gram matrix computed together
+ROWS = 64
+
+
+class SubsequenceKernel(object):
+    """
+    Sums, over the common subsequences of 1 to `n` elements of two
+    sequences, the product of the numbers of features their elements have
+    in common, weighted by `lmd` to the number of positions they span in
+    both sequences (gaps included). Each element is a (word, POS,
+    collapsed POS) tuple, the mentions being (NE type, 'E1'/'E2', 'E').
+
+    The dynamic program is run for a whole batch of integer-encoded pairs:
+    the values of a subsequence length are decayed cumulative sums of the
+    previous ones, over both sequences, each position being one array
+    operation over the whole batch.
+
+    >>> kernel = SubsequenceKernel(n=2, lmd=0.5)
+    >>> a = kernel.encode([('the', 'DT', 'D'), ('big', 'JJ', 'J'), ('dog', 'NN', 'N')])
+    >>> b = kernel.encode([('the', 'DT', 'D'), ('dog', 'NN', 'N')])
+    >>> kernel(b, b)
+    2.0625
+    >>> kernel(a, b)
+    1.78125
+    >>> kernel.gram_matrix([a, b], normalized=False)
+    array([[3.515625, 1.78125 ],
+           [1.78125 , 2.0625  ]])
+    """
+
+    def __init__(self, n=3, lmd=0.5, window=2, max_between=None):
+        """
+        :param window: number of words kept before and after the mentions
+        :param max_between: if set, only the first and last
+                            `max_between // 2` words between the mentions
+                            are kept
+        """
+        self.n = n
+        self.lmd = lmd
+        self.window = window
+        self.max_between = max_between
+        self.vocabularies = [dict() for _ in range(3)]
+
+    def encode(self, elements):
+        """-> the (elements x features) integer array of a sequence"""
+        return np.array([[v.setdefault(x, len(v))
+                          for v, x in zip(self.vocabularies, element)]
+                         for element in elements], dtype=np.int32).reshape(-1, 3)
+
+    def sequence(self, mentionpair, documents):
+        """
+        -> the encoded sequence of a MentionPair: `window` words before
+        the left mention, the left mention, the words between the
+        mentions, the right mention and `window` words after it
+        """
+        document = documents[mentionpair.filename]
+        sent_index = mentionpair.left.sent_index
+        words = document.first_fields[sent_index]
+        postags = document.second_fields[sent_index]
+        start = mentionpair.left.indices[0]
+        end = mentionpair.right.indices[-1] + 1
+        between = zip(mentionpair.between_tokens(documents),
+                      mentionpair.between_tags(documents))
+        if self.max_between is not None and len(between) > self.max_between:
+            half = self.max_between // 2
+            between = between[:half] + between[len(between) - half:]
+        before = zip(words[max(start - self.window, 0):start],
+                     postags[max(start - self.window, 0):start])
+        after = zip(words[end:end + self.window], postags[end:end + self.window])
+        elements = [(w.lower(), t, t[:1]) for w, t in before]
+        elements.append((mentionpair.left.netype, 'E1', 'E'))
+        elements.extend((w.lower(), t, t[:1]) for w, t in between)
+        elements.append((mentionpair.right.netype, 'E2', 'E'))
+        elements.extend((w.lower(), t, t[:1]) for w, t in after)
+        return self.encode(elements)
+
+    def _batch(self, common):
+        """
+        -> the kernel values of a batch of sequence pairs, from the
+        (pairs x positions x positions) numbers of common features of
+        their elements
+        """
+        lmd = self.lmd
+        values = lmd ** 2 * common.sum((1, 2))
+        matches = common
+        for p in range(2, self.n + 1):
+            # K'_(p-1)(x[:i], y[:j]) at [i, j]: the decayed matches of the
+            # shorter subsequences in the prefixes, summed one position at
+            # a time (for all the pairs at once) along each sequence
+            prefix = matches.copy()
+            for j in range(1, prefix.shape[2]):
+                prefix[:, :, j] += lmd * prefix[:, :, j - 1]
+            for i in range(1, prefix.shape[1]):
+                prefix[:, i] += lmd * prefix[:, i - 1]
+            prefix *= lmd ** 2
+            matches = np.zeros(common.shape)
+            np.multiply(common[:, 1:, 1:], prefix[:, :-1, :-1],
+                        out=matches[:, 1:, 1:])
+            values += lmd ** 2 * matches.sum((1, 2))
+        return values
+
+    def __call__(self, a, b):
+        """kernel of two encoded sequences (0.0 if any is None)"""
+        if a is None or b is None:
+            return 0.0
+        return float(self._batch(_common(a[np.newaxis], b[np.newaxis]))[0])
+
+    def norms(self, sequences):
+        """-> the square root of the kernel value of each sequence with itself"""
+        norms = np.zeros(len(sequences))
+        for rows in _blocks(sequences, range(len(sequences)), BLOCK_SIZE,
+                            square=True):
+            x = _pad(sequences, rows, -1)
+            y = _pad(sequences, rows, -2)
+            norms[rows] = np.sqrt(self._batch(_common(x, y)))
+        return norms
+
+    def gram_matrix(self, sequences_x, sequences_y=None, normalized=True):
+        """
+        -> the kernel values of sequences_x (rows) with sequences_y
+        (columns), or of sequences_x with themselves (only computing the
+        upper triangle), as a block for `svm.SVC(kernel='precomputed')`
+
+        :param normalized: divide the values by the norms of the sequences
+        """
+        symmetric = sequences_y is None
+        if symmetric:
+            sequences_y = sequences_x
+        gram = np.zeros((len(sequences_x), len(sequences_y)))
+        present_x = [i for i, x in enumerate(sequences_x) if x is not None]
+        present_y = [j for j, y in enumerate(sequences_y) if y is not None]
+        # sequences of similar lengths are padded together
+        present_x.sort(key=lambda i: len(sequences_x[i]))
+        present_y.sort(key=lambda j: len(sequences_y[j]))
+        if not present_x or not present_y:
+            return gram
+        for k in range(0, len(present_x), ROWS):
+            rows = present_x[k:k + ROWS]
+            x = _pad(sequences_x, rows, -1)
+            # (upper triangle) columns of the rows, by blocks of columns
+            # padding to BLOCK_SIZE cells with the rows
+            cols = present_y[k:] if symmetric else present_y
+            for cols in _blocks(sequences_y, cols,
+                                BLOCK_SIZE // (len(rows) * x.shape[1])):
+                y = _pad(sequences_y, cols, -2)
+                # every row with every column
+                common = _common(x[:, np.newaxis], y[np.newaxis])
+                values = self._batch(common.reshape((-1,) + common.shape[2:]))
+                values = values.reshape(len(rows), len(cols))
+                gram[np.ix_(rows, cols)] = values
+                if symmetric:
+                    gram[np.ix_(cols, rows)] = values.T
+        if normalized:
+            norms_x = np.zeros(len(sequences_x))
+            norms_x[present_x] = self.norms([sequences_x[i] for i in present_x])
+            if symmetric:
+                norms_y = norms_x
+            else:
+                norms_y = np.zeros(len(sequences_y))
+                norms_y[present_y] = self.norms([sequences_y[j] for j in present_y])
+            scale = np.outer(norms_x, norms_y)
+            np.divide(gram, scale, out=gram, where=scale > 0)
+        return gram
+
+
+def _common(x, y):
+    """
+    -> the numbers of common features of the elements of (..., positions
+    x features) arrays, as (..., positions x positions)
+    """
+    x = x[..., :, np.newaxis, :]
+    y = y[..., np.newaxis, :, :]
+    common = (x[..., 0] == y[..., 0]).astype(np.float64)
+    for f in range(1, x.shape[-1]):
+        common += x[..., f] == y[..., f]
+    return common
+
+
+def _pad(sequences, indices, fill):
+    """-> the (indices x longest x features) array of some sequences"""
+    length = max(len(sequences[i]) for i in indices)
+    padded = np.empty((len(indices), length, 3), dtype=np.int32)
+    padded.fill(fill)
+    for k, i in enumerate(indices):
+        padded[k, :len(sequences[i])] = sequences[i]
+    return padded
+
+
+def _blocks(sequences, indices, size, square=False):
+    """
+    -> lists of indices which, padded, have at most `size` positions (or
+    position x position cells if `square`)
+    """
+    block, longest = list(), 0
+    for i in indices:
+        length = max(longest, len(sequences[i]))
+        if block and (len(block) + 1) * length ** (2 if square else 1) > size:
+            yield block
+            block, length = list(), len(sequences[i])
+        block.append(i)
+        longest = length
+    if block:
+        yield block
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train and test an SVM with the subsequence kernel")
+    parser.add_argument('--train', dest='trainset', help="path to the training data",
+                        default='./data/rel-trainset.gold')
+    parser.add_argument('--test', dest='testset', help="path to the test data (with gold labels)",
+                        default='./data/rel-testset.gold')
+    parser.add_argument('-n', dest='n', type=int,
+                        help="longest common subsequences counted", default=3)
+    parser.add_argument('--lambda', dest='lmd', type=float,
+                        help="decay of the positions spanned", default=0.5)
+    parser.add_argument('--window', dest='window', type=int,
+                        help="words kept before and after the mentions", default=2)
+    parser.add_argument('--max-between', dest='max_between', type=int,
+                        help="words kept between the mentions (all by default)",
+                        default=None)
+    args = parser.parse_args()
+    from sklearn import svm
+    from util import load_documents, load_mention_pairs
+    from kernels import load_labels, evaluate
+    documents = load_documents()
+    kernel = SubsequenceKernel(args.n, args.lmd, args.window, args.max_between)
+    train = [kernel.sequence(m, documents)
+             for m in load_mention_pairs(args.trainset)]
+    test = [kernel.sequence(m, documents)
+            for m in load_mention_pairs(args.testset)]
+    clf = svm.SVC(kernel='precomputed')
+    clf.fit(kernel.gram_matrix(train), load_labels(args.trainset))
+    hypothesis = clf.predict(kernel.gram_matrix(test, train))
+    precision, recall, f = evaluate(load_labels(args.testset), hypothesis)
+    print "Precision: %.2f\nRecall: %.2f\nF1: %.2f" % \
+        ((precision * 100), (recall * 100), (f * 100))
+
+
+if __name__ == '__main__':
+    main()
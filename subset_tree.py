@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# coding: utf-8
+
+from itertools import izip
+import numpy as np
+
+
+"""
+A fast subset tree kernel (Moschitti, 2006) over path-enclosed
+constituency trees
+"""
+
+
+class CompiledTree(object):
+    """
+    A constituency (sub)tree with its nodes in post-order (children before
+    their parent): `productions[i]` is the production id of node `i`,
+    `children[i]` its child nodes (empty for preterminals), and `sorted`
+    the (production id, node) pairs in increasing order
+    """
+
+    def __init__(self, productions, children):
+        self.productions = productions
+        self.children = children
+        self.sorted = sorted((x, i) for i, x in enumerate(productions))
+        self.norm = None
+
+    def __len__(self):
+        return len(self.productions)
+
+
+class SubsetTreeKernel(object):
+    """
+    Counts the subset trees (fragments of whole productions) two trees have
+    in common, each weighted by `lmd` to the number of its productions.
+    Only the node pairs with the same production are considered: they are
+    found by merging the sorted production lists of the two trees, and
+    their counts are computed children first.
+
+    >>> from nltk import ParentedTree
+    >>> from span_index import SpanIndex
+    >>> kernel = SubsetTreeKernel(lmd=1.0)
+    >>> index = SpanIndex(ParentedTree.fromstring(
+    ...     "(S (NP (D the) (N dog)) (VP (V chased) (NP (D the) (N cat))))"))
+    >>> a = kernel.path_enclosed_tree(index, 0, 5)
+    >>> b = kernel.path_enclosed_tree(index, 3, 5)
+    >>> len(a), len(b)
+    (9, 3)
+    >>> kernel(b, b)
+    6.0
+    >>> kernel(a, b)
+    9.0
+    >>> round(kernel.normalized(a, b), 4)
+    0.4009
+    """
+
+    def __init__(self, lmd=0.4):
+        self.lmd = lmd
+        self.vocabulary = dict()
+
+    def _production(self, production):
+        return self.vocabulary.setdefault(production, len(self.vocabulary))
+
+    def path_enclosed_tree(self, index, start, end):
+        """
+        -> the CompiledTree of the path-enclosed tree of leaves `start` to
+        `end` (excluded): the lowest node spanning them, with only the
+        nodes covering some of these leaves
+
+        :param index: the SpanIndex of the parse tree
+        """
+        productions = list()
+        children = list()
+        root = index.spanning(start, end)
+        # (node, whether its children have been visited)
+        stack = [(root, False)]
+        compiled = dict()
+        while stack:
+            k, visited = stack.pop()
+            kids = [c for c in index.children(k)
+                    if index.leaf_span(c)[0] < end and
+                    index.leaf_span(c)[1] > start]
+            if not visited and kids:
+                stack.append((k, True))
+                stack.extend((c, False) for c in reversed(kids))
+                continue
+            if kids:
+                production = (index.labels[k],) + \
+                    tuple(index.labels[c] for c in kids)
+            else:
+                first, last = index.leaf_span(k)
+                production = (index.labels[k], tuple(index.leaves[first:last]))
+            compiled[k] = len(productions)
+            productions.append(self._production(production))
+            children.append(tuple(compiled[c] for c in kids))
+        return CompiledTree(productions, children)
+
+    def pair_tree(self, mentionpair, documents):
+        """
+        -> the CompiledTree of the path-enclosed tree of the two mentions
+        of a MentionPair, None if they are in different sentences
+        """
+        left, right = mentionpair.left, mentionpair.right
+        if left.sent_index != right.sent_index:
+            return None
+        indices = sorted(left.indices + right.indices)
+        index = documents[mentionpair.filename].span_indices[left.sent_index]
+        return self.path_enclosed_tree(index, indices[0], indices[-1] + 1)
+
+    def __call__(self, a, b):
+        """kernel of two CompiledTrees (0.0 if any is None)"""
+        if a is None or b is None:
+            return 0.0
+        pairs = _matching_pairs(a.sorted, b.sorted)
+        # in post-order, the children pairs are computed first
+        pairs.sort()
+        lmd = self.lmd
+        delta = dict()
+        total = 0.0
+        for n1, n2 in pairs:
+            value = lmd
+            for c1, c2 in izip(a.children[n1], b.children[n2]):
+                value *= 1.0 + delta.get((c1, c2), 0.0)
+            delta[n1, n2] = value
+            total += value
+        return total
+
+    def normalized(self, a, b):
+        """kernel divided by the norms of the two trees"""
+        if a is None or b is None:
+            return 0.0
+        for x in (a, b):
+            if x.norm is None:
+                x.norm = np.sqrt(self(x, x))
+        return self(a, b) / (a.norm * b.norm)
+
+    def gram_matrix(self, trees_x, trees_y=None, normalized=True):
+        """-> the kernel values of trees_x (rows) with trees_y (columns)"""
+        kernel = self.normalized if normalized else self
+        symmetric = trees_y is None
+        trees_y = trees_x if symmetric else trees_y
+        gram = np.zeros((len(trees_x), len(trees_y)))
+        for i, a in enumerate(trees_x):
+            for j in range(i if symmetric else 0, len(trees_y)):
+                gram[i, j] = kernel(a, trees_y[j])
+                if symmetric:
+                    gram[j, i] = gram[i, j]
+        return gram
+
+
+def _matching_pairs(a, b):
+    """
+    -> the (node of a, node of b) pairs with the same production, merging
+    two sorted (production, node) lists
+    """
+    pairs = list()
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i][0] < b[j][0]:
+            i += 1
+        elif a[i][0] > b[j][0]:
+            j += 1
+        else:
+            production = a[i][0]
+            i_end = i
+            while i_end < len(a) and a[i_end][0] == production:
+                i_end += 1
+            j_end = j
+            while j_end < len(b) and b[j_end][0] == production:
+                j_end += 1
+            for _, n1 in a[i:i_end]:
+                for _, n2 in b[j:j_end]:
+                    pairs.append((n1, n2))
+            i, j = i_end, j_end
+    return pairs
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -1,14 +1,26 @@
 from collections import namedtuple
+from itertools import imap
+from multiprocessing import Pool
+from time import time
+import os
 import sys
+import hashlib
+import argparse
 from sklearn import svm
 import numpy as np
-from nltk.corpus import wordnet as wn
+from numpy.lib.format import open_memmap
+from scipy import sparse
 from util import load_documents
 from util import load_mention_pairs
-from kernels import load_labels
+from kernels import load_labels, evaluate
+from node_features import load_node_features, lexical_features
+from dependency_path import ShortestPathKernel
+from subset_tree import SubsetTreeKernel
 
 
 documents = load_documents()
+# lexical features of the dependency nodes, loaded on first use
+node_table = None
 
 
 Feature = namedtuple('Feature', ['word', 'pos', 'cpos', 'chunktag', 'hypernym', 'netypes'])
@@ -20,26 +32,19 @@ def features(t, sent_index, filename):
     Get the features of a dep tree
     features include:
     word, POS, Collapsed_POS, ChunkTag, WordNet_Hypernym
+    (looked up in the node feature table), and the NE types
     """
-    word = t.token.lower()
-    parse_tree = documents[filename].parsed_sents[sent_index]
-    pos = parse_tree.pos()[t.index]
-    collapsed = pos[0]
-    treeposition = parse_tree.treeposition_spanning_leaves(t.index, t.index+1)[:-2]
-    chunktag = parse_tree[treeposition].label()
-    if chunktag.startswith("N"): chunktag = 'NP'
-    elif chunktag.startswith("V"): chunktag = "VP"
-    elif chunktag.startswith("P"): chunktag = "VP"
-    else: chunktag = 'OTHER'
-    try:
-        hypernym = wn.synsets(word).hypernyms()[0]
-    except Exception:
-        hypernym = None
+    global node_table
+    if node_table is None:
+        node_table = load_node_features(documents)
+    lexical = node_table.get(t, sent_index, filename)
+    if lexical is None:
+        lexical = lexical_features(t, documents[filename].span_indices[sent_index])
     try:
         netypes = t.netypes
     except Exception:
         netypes = None
-    return Feature(word, pos, collapsed, chunktag, hypernym, netypes)
+    return Feature(*(lexical + (netypes,)))
 
 
 def match(f1, f2):
@@ -79,41 +84,775 @@ def culotta_sorensen(t1, t2, sent_index1, sent_index2,
         return score
 
 
-def get_gram_matrix(data1, data2, saveto=''):
-    mentionpairs_x = load_mention_pairs(data1)
-    instances_x = [Instance(m.lca(documents), m.left.sent_index, m.left.filename)
-                   for m in mentionpairs_x]
-    if data2 is None:
-        mentionpairs_y = mentionpairs_x
+# fields which must be equal for two nodes to match (see `match`)
+MATCH_FIELDS = (Feature._fields.index('cpos'), Feature._fields.index('netypes'))
+
+
+def node_features(t, sent_index, filename):
+    """the features of a node, computed once and kept on the node"""
+    if t.features is None:
+        t.features = features(t, sent_index, filename)
+    return t.features
+
+
+class FeatureEncoder(object):
+    """
+    maps the values of each feature field, and the values of the fields
+    compared by `match`, to small integers
+    """
+
+    def __init__(self):
+        self.vocabularies = [dict() for _ in Feature._fields]
+        self.match_keys = dict()
+
+    def encode(self, f):
+        """-> (integer feature tuple, integer match key)"""
+        codes = tuple(v.setdefault(x, len(v))
+                      for v, x in zip(self.vocabularies, f))
+        match_key = tuple(codes[i] for i in MATCH_FIELDS)
+        return codes, self.match_keys.setdefault(match_key, len(self.match_keys))
+
+
+class CompiledTree(object):
+    """
+    A dependency (sub)tree with its nodes numbered in pre-order (the root
+    is 0): `codes[i]` are the integer-encoded features of node `i`,
+    `keys[i]` its match key (nodes match iff their keys are equal), and
+    `groups[i]` maps the keys of its children to the children's numbers.
+    `digest` identifies the content (features and shape) of the tree.
+    """
+
+    def __init__(self, tree, sent_index, filename, encoder):
+        self.codes = list()
+        self.keys = list()
+        self.groups = list()
+        sha = hashlib.sha1()
+        stack = [(tree, None)]
+        while stack:
+            t, parent = stack.pop()
+            f = node_features(t, sent_index, filename)
+            sha.update(repr((f, parent)))
+            codes, key = encoder.encode(f)
+            i = len(self.codes)
+            self.codes.append(codes)
+            self.keys.append(key)
+            self.groups.append(dict())
+            if parent is not None:
+                self.groups[parent].setdefault(key, list()).append(i)
+            stack.extend((c, i) for c in reversed(t.children))
+        self.digest = sha.hexdigest()
+
+
+class CulottaSorensen(object):
+    """
+    Same kernel as `culotta_sorensen`, on compiled trees: the features of
+    the nodes are only computed when the tree is compiled, and compared as
+    integers. Only the children pairs with the same match key are
+    recursed into, instead of all the children pairs.
+    """
+
+    def __init__(self, lmd=0.5):
+        self.lmd = lmd
+        self.encoder = FeatureEncoder()
+        self._compiled = dict()
+
+    def compile(self, instance):
+        """-> the CompiledTree of an Instance (None if it has no tree)"""
+        if instance.tree is None:
+            return None
+        key = id(instance.tree)
+        try:
+            return self._compiled[key][1]
+        except KeyError:
+            compiled = CompiledTree(instance.tree, instance.sent_index,
+                                    instance.filename, self.encoder)
+            # the tree is kept so that its id is not reused
+            self._compiled[key] = (instance.tree, compiled)
+            return compiled
+
+    def __call__(self, a, b):
+        """kernel of two CompiledTrees"""
+        if a is None or b is None or a.keys[0] != b.keys[0]:
+            return 0.0
+        return float(self._kernel(a, 0, b, 0, 0))
+
+    def _kernel(self, a, i, b, j, decay):
+        """kernel of node `i` of `a` and node `j` of `b`, which match"""
+        score = 0
+        for x, y in zip(a.codes[i], b.codes[j]):
+            if x == y:
+                score += 1
+        groups = b.groups[j]
+        if groups:
+            weight = self.lmd ** decay
+            for key, children in a.groups[i].iteritems():
+                others = groups.get(key)
+                if others:
+                    for c1 in children:
+                        for c2 in others:
+                            score += weight * self._kernel(a, c1, b, c2,
+                                                           decay + 1)
+        return score
+
+
+def _unique(items):
+    """-> (distinct items, position of each item in the distinct ones)"""
+    positions = dict()
+    distinct = list()
+    index = list()
+    for x in items:
+        if id(x) not in positions:
+            positions[id(x)] = len(distinct)
+            distinct.append(x)
+        index.append(positions[id(x)])
+    return distinct, np.array(index, dtype=np.intp)
+
+
+# side of the square tiles in which gram matrices are computed
+TILE_SIZE = 256
+
+# bump this to invalidate the stored kernel values (see GramStore)
+GRAM_STORE_VERSION = 1
+
+# how often (in seconds) the progress of a gram matrix is reported
+PROGRESS_EVERY = 60
+
+# the kernel and compiled trees of the gram matrix being computed, set
+# before the worker processes are forked so that they inherit them
+_gram_state = None
+
+
+def _buckets(trees):
+    """
+    -> {root match key: positions of the trees}; trees with different
+    root keys do not match, so their kernel value is zero
+    """
+    buckets = dict()
+    for i, t in enumerate(trees):
+        if t is not None:
+            buckets.setdefault(t.keys[0], list()).append(i)
+    return dict((k, np.array(v, dtype=np.intp)) for k, v in buckets.iteritems())
+
+
+def _chunks(n, size):
+    """-> the (start, end) of the chunks of `size` items of `n` items"""
+    return [(i0, min(i0 + size, n)) for i0 in range(0, n, size)]
+
+
+def _tiles(buckets_x, buckets_y, size, symmetric):
+    """
+    -> the (bucket, row start, row end, column start, column end) of the
+    tiles, the rows and columns being positions within the bucket
+    """
+    for key in sorted(buckets_x):
+        if key not in buckets_y:
+            continue
+        n, m = len(buckets_x[key]), len(buckets_y[key])
+        for i0 in range(0, n, size):
+            for j0 in range(i0 if symmetric else 0, m, size):
+                yield (key, i0, min(i0 + size, n), j0, min(j0 + size, m))
+
+
+def _tile_size(tile, symmetric):
+    """number of kernel values computed for a tile"""
+    _, i0, i1, j0, j1 = tile
+    if symmetric and i0 == j0:
+        return (i1 - i0) * (i1 - i0 + 1) // 2
+    return (i1 - i0) * (j1 - j0)
+
+
+def _tile_cells(tile, buckets_x, buckets_y):
+    """-> (rows, columns) of the gram matrix covered by a tile"""
+    key, i0, i1, j0, j1 = tile
+    return buckets_x[key][i0:i1], buckets_y[key][j0:j1]
+
+
+def _gram_tile(tile):
+    """
+    -> (tile, kernel values of the tile); on the diagonal of a symmetric
+    matrix only the upper triangle is computed, and mirrored
+    """
+    kernel, trees_x, trees_y, buckets_x, buckets_y, symmetric = _gram_state
+    rows, cols = _tile_cells(tile, buckets_x, buckets_y)
+    values = np.zeros((len(rows), len(cols)))
+    diagonal = symmetric and tile[1] == tile[3]
+    for i, row in enumerate(rows):
+        a = trees_x[row]
+        for j in range(i if diagonal else 0, len(cols)):
+            values[i, j] = kernel(a, trees_y[cols[j]])
+    if diagonal:
+        values += np.triu(values, 1).T
+    return tile, values
+
+
+def _self_values(rows):
+    """-> (rows, kernel value of each tree of the rows with itself)"""
+    kernel, trees = _gram_state[:2]
+    i0, i1 = rows
+    return rows, np.array([kernel(t, t) for t in trees[i0:i1]])
+
+
+def _landmark_column(task):
+    """
+    -> (task, kernel values of the landmark with a chunk of the trees of
+    its bucket), the task being (landmark, chunk start, chunk end)
+    """
+    kernel, trees, _, buckets, _, _ = _gram_state
+    landmark, i0, i1 = task
+    b = trees[landmark]
+    rows = buckets[b.keys[0]][i0:i1]
+    return task, np.array([kernel(trees[row], b) for row in rows])
+
+
+class _SparseGram(object):
+    """
+    Collects the nonzero values written to it by `_fill_gram`, in place of
+    a dense matrix
+    """
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.rows = list()
+        self.cols = list()
+        self.data = list()
+
+    def __setitem__(self, cells, values):
+        rows, cols = np.nonzero(values)
+        self.rows.append(cells[0].ravel()[rows])
+        self.cols.append(cells[1].ravel()[cols])
+        self.data.append(values[rows, cols])
+
+    def tocsr(self):
+        if not self.data:
+            return sparse.csr_matrix(self.shape)
+        return sparse.coo_matrix((np.concatenate(self.data),
+                                  (np.concatenate(self.rows),
+                                   np.concatenate(self.cols))),
+                                 shape=self.shape).tocsr()
+
+
+def _gram_signature(data1, data2, shape, dtype, tile_size, lmd):
+    """-> what a checkpoint must have been computed from to be resumed"""
+    sha = hashlib.sha1(repr((shape, np.dtype(dtype).str, tile_size, lmd,
+                             'buckets')))
+    for data in (data1, data2):
+        if data is not None:
+            with open(data, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _open_checkpoint(saveto, shape, dtype, signature):
+    """
+    -> (memmap of the distinct trees' kernel values, completed tiles, log
+    of the completed tiles), resuming the checkpoint of `saveto` if it was
+    computed from the same inputs
+    """
+    values_file = saveto + '.tiles.npy'
+    log_file = saveto + '.done'
+    done = set()
+    try:
+        with open(log_file) as f:
+            if f.readline().strip() == signature:
+                for line in f:
+                    if line.endswith('\n'):
+                        done.add(tuple(int(x) for x in line.split()))
+    except IOError:
+        pass
+    if done and os.path.exists(values_file):
+        values = open_memmap(values_file, mode='r+')
+    else:
+        done = set()
+        values = open_memmap(values_file, mode='w+', dtype=dtype, shape=shape)
+        with open(log_file, 'w') as f:
+            f.write(signature + '\n')
+    return values, done, open(log_file, 'a')
+
+
+def _progress(count, total, start):
+    """ report the rate and ETA of the gram matrix computation """
+    elapsed = time() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    eta = (total - count) / rate if rate > 0 else float('inf')
+    sys.stderr.write("{}/{} kernel values, {:.0f} values/sec, "
+                     "ETA {:.0f} sec\n".format(count, total, rate, eta))
+
+
+def _expansion(index, n):
+    """-> sparse 0/1 matrix mapping each instance to its distinct tree"""
+    return sparse.csr_matrix((np.ones(len(index)), (np.arange(len(index)), index)),
+                             shape=(len(index), n))
+
+
+def load_instances(data):
+    """-> the Instance (lca dependency tree) of every mention pair of a file"""
+    return [Instance(m.lca(documents), m.left.sent_index, m.left.filename)
+            for m in load_mention_pairs(data)]
+
+
+def load_paths(data, kernel):
+    """-> the encoded shortest dependency path of every mention pair of a file"""
+    return [kernel.path(m, documents) for m in load_mention_pairs(data)]
+
+
+def load_pets(data, kernel):
+    """
+    -> the compiled path-enclosed tree of every mention pair of a file
+    (all compiled by `kernel`, which numbers their productions)
+    """
+    return [kernel.pair_tree(m, documents) for m in load_mention_pairs(data)]
+
+
+def _fill_gram(kernel, trees_x, trees_y, symmetric, values, done=(), log=None,
+               jobs=1, tile_size=TILE_SIZE, report=True):
+    """
+    Compute the kernel values of `trees_x` with `trees_y` into `values`,
+    tile after tile, skipping the `done` tiles and logging the completed
+    ones to `log`. The trees are bucketed by the match key of their root,
+    and only the pairs of trees of the same bucket are evaluated: the
+    other values are structural zeros, left as they are in `values`.
+    """
+    global _gram_state
+    buckets_x = _buckets(trees_x)
+    buckets_y = buckets_x if symmetric else _buckets(trees_y)
+    tiles = [x for x in _tiles(buckets_x, buckets_y, tile_size, symmetric)
+             if x not in done]
+    total = sum(_tile_size(x, symmetric) for x in tiles)
+    _gram_state = (kernel, trees_x, trees_y, buckets_x, buckets_y, symmetric)
+    pool = Pool(jobs) if jobs > 1 else None
+    try:
+        if pool is None:
+            results = imap(_gram_tile, tiles)
+        else:
+            results = pool.imap_unordered(_gram_tile, tiles)
+        start = last_report = time()
+        count = 0
+        for tile, tile_values in results:
+            rows, cols = _tile_cells(tile, buckets_x, buckets_y)
+            values[np.ix_(rows, cols)] = tile_values
+            # (diagonal tiles are already mirrored)
+            if symmetric and tile[1] != tile[3]:
+                values[np.ix_(cols, rows)] = tile_values.T
+            if log is not None:
+                # the tile is only marked as done once its values are on disk
+                values.flush()
+                log.write('{} {} {} {} {}\n'.format(*tile))
+                log.flush()
+                os.fsync(log.fileno())
+            count += _tile_size(tile, symmetric)
+            if report and time() - last_report >= PROGRESS_EVERY:
+                _progress(count, total, start)
+                last_report = time()
+        if report:
+            _progress(count, total, start)
+            cells = len(trees_x) * len(trees_y)
+            if symmetric:
+                cells = len(trees_x) * (len(trees_x) + 1) // 2
+            sys.stderr.write("{} of {} kernel values evaluated, the others "
+                             "are structural zeros\n".format(total, cells))
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _gram_state = None
+    return values
+
+
+class GramStore(object):
+    """
+    Kernel values kept on disk between runs, so that only the values of
+    trees never seen before are computed. Trees are identified by the
+    digest of their content (see CompiledTree), and the values of each
+    kernel parameter set (`lmd`) are kept in their own folder:
+
+    - `trees.txt`: the digest of each stored tree, one per line
+    - `values.npy`: the (symmetric) kernel values of the stored trees
+    - `known.npy`: which of these values have been computed
+
+    The two matrices are memory-mapped, and grown as trees are added.
+    """
+
+    def __init__(self, folder, lmd=0.5):
+        sha = hashlib.sha1(repr((GRAM_STORE_VERSION, lmd)))
+        self.folder = os.path.join(folder, 'lmd{}-{}'.format(
+            lmd, sha.hexdigest()[:8]))
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.ids = dict()
+        trees_file = os.path.join(self.folder, 'trees.txt')
+        if os.path.exists(trees_file):
+            with open(trees_file) as f:
+                for line in f:
+                    if line.endswith('\n'):
+                        self.ids[line.strip()] = len(self.ids)
+        try:
+            self.values = open_memmap(self._path('values'), mode='r+')
+            self.known = open_memmap(self._path('known'), mode='r+')
+        except IOError:
+            self.ids = dict()
+            open(trees_file, 'w').close()
+            self.values = self.known = None
+            self._grow(1024)
+        if len(self.ids) > self.values.shape[0]:
+            # interrupted while growing: the new trees have no values
+            self._grow(len(self.ids))
+        self.computed = 0
+
+    def _path(self, name):
+        return os.path.join(self.folder, name + '.npy')
+
+    def _grow(self, capacity):
+        """reallocate the matrices for `capacity` trees"""
+        for name in ('values', 'known'):
+            old = getattr(self, name)
+            dtype = np.bool_ if name == 'known' else np.float64
+            tmp = self._path(name + '.tmp')
+            new = open_memmap(tmp, mode='w+', dtype=dtype,
+                              shape=(capacity, capacity))
+            if old is not None:
+                n = old.shape[0]
+                new[:n, :n] = old
+            new.flush()
+            del old, new
+            os.rename(tmp, self._path(name))
+            setattr(self, name, open_memmap(self._path(name), mode='r+'))
+
+    def _ids(self, trees):
+        """-> the store indices of the trees, adding the new ones"""
+        new = [x.digest for x in trees
+               if x is not None and x.digest not in self.ids]
+        if new:
+            with open(os.path.join(self.folder, 'trees.txt'), 'a') as f:
+                for digest in new:
+                    if digest not in self.ids:
+                        self.ids[digest] = len(self.ids)
+                        f.write(digest + '\n')
+            if len(self.ids) > self.values.shape[0]:
+                self._grow(max(2 * self.values.shape[0], len(self.ids)))
+        return np.array([-1 if x is None else self.ids[x.digest]
+                         for x in trees], dtype=np.intp)
+
+    def _compute(self, kernel, trees_x, rows, trees_y, cols, jobs, tile_size,
+                 symmetric=False):
+        """
+        compute and store the values of trees_x[rows] with trees_y[cols]
+        (the same trees if `symmetric`)
+        """
+        if not len(rows) or not len(cols):
+            return
+        block = _fill_gram(kernel, [trees_x[i] for i in rows],
+                           [trees_y[j] for j in cols], symmetric,
+                           np.zeros((len(rows), len(cols))),
+                           jobs=jobs, tile_size=tile_size)
+        ids_x = self._ids([trees_x[i] for i in rows])
+        ids_y = self._ids([trees_y[j] for j in cols])
+        # the kernel is symmetric: each value is stored both ways
+        for ids_a, ids_b, values in ((ids_x, ids_y, block),
+                                     (ids_y, ids_x, block.T)):
+            cells = np.ix_(ids_a, ids_b)
+            self.values[cells] = values
+            self.known[cells] = True
+        self.values.flush()
+        self.known.flush()
+        self.computed += block.size
+
+    def gram(self, kernel, trees_x, trees_y, jobs=1, tile_size=TILE_SIZE):
+        """
+        -> the kernel values of trees_x (rows) with trees_y (columns),
+        computing (and storing) the missing ones only
+        """
+        result = np.zeros((len(trees_x), len(trees_y)))
+        # trees without a tree (None) have no values to store
+        rows = np.array([i for i, x in enumerate(trees_x) if x is not None],
+                        dtype=np.intp)
+        cols = np.array([j for j, y in enumerate(trees_y) if y is not None],
+                        dtype=np.intp)
+        if not len(rows) or not len(cols):
+            return result
+        ids_x = self._ids([trees_x[i] for i in rows])
+        ids_y = self._ids([trees_y[j] for j in cols])
+        missing = ~self.known[np.ix_(ids_x, ids_y)]
+        # the rows missing every value (new trees) are computed whole,
+        # then the rows still missing values, for the columns they miss
+        new_rows = missing.all(1)
+        if trees_x is trees_y:
+            # only one triangle of the new trees' block is computed
+            new = rows[new_rows]
+            self._compute(kernel, trees_x, new, trees_y, new, jobs,
+                          tile_size, symmetric=True)
+            self._compute(kernel, trees_x, new, trees_y, cols[~new_rows],
+                          jobs, tile_size)
+        else:
+            self._compute(kernel, trees_x, rows[new_rows], trees_y, cols,
+                          jobs, tile_size)
+        missing = ~self.known[np.ix_(ids_x, ids_y)]
+        old_rows = missing.any(1)
+        some_cols = missing[old_rows].any(0)
+        self._compute(kernel, trees_x, rows[old_rows], trees_y,
+                      cols[some_cols], jobs, tile_size)
+        result[np.ix_(rows, cols)] = self.values[np.ix_(ids_x, ids_y)]
+        return result
+
+
+def get_gram_matrix(data1, data2, saveto='', jobs=1, dtype=np.float64,
+                    tile_size=TILE_SIZE, store=None, sparse_output=False):
+    """
+    -> the kernel values of each instance of `data1` (rows) with each
+    instance of `data2` (columns), or of `data1` with itself if `data2` is
+    None, in which case only the upper triangle is computed
+
+    :param saveto: the .npy file of the matrix, which is written through a
+                   memory map; the completed tiles are checkpointed next to
+                   it, so that an interrupted run resumes from there
+    :param jobs: number of processes computing the tiles
+    :param dtype: np.float64, or np.float32 to halve the memory
+    :param tile_size: side of the square tiles handed to the processes
+    :param store: a GramStore folder: only the values missing from the
+                  store are computed (and added to it); the store is the
+                  checkpoint, `saveto` only receives the matrix
+    :param sparse_output: return a sparse (CSR) matrix of the nonzero
+                          values instead, saved to `saveto` as .npz (and
+                          computed without checkpoints unless in a store)
+    """
+    instances_x = load_instances(data1)
+    symmetric = data2 is None
+    if symmetric:
         instances_y = instances_x
     else:
-        mentionpairs_y = load_mention_pairs(data2)
-        instances_y = [Instance(m.lca(documents), m.left.sent_index, m.left.filename)
-                       for m in mentionpairs_y]
-    size = (len(mentionpairs_x), len(mentionpairs_y))
-    gram = np.zeros(size)
-    for i, a in enumerate(instances_x):
-        for j, b in enumerate(instances_y):
-            sys.stderr.write('\r')
-            sys.stderr.write("({}, {})".format(i, j))
-            score = culotta_sorensen(a.tree, b.tree, a.sent_index, b.sent_index,
-                                     a.filename, b.filename)
-            sys.stderr.write(' : {}'.format(score))
-            gram[i,j] = score
-    sys.stderr.write('\n')
+        instances_y = load_instances(data2)
+    kernel = CulottaSorensen()
+    # instances sharing their tree share their row/column of the matrix
+    trees_x, index_x = _unique([kernel.compile(x) for x in instances_x])
+    if symmetric:
+        trees_y, index_y = trees_x, index_x
+    else:
+        trees_y, index_y = _unique([kernel.compile(y) for y in instances_y])
+    shape = (len(trees_x), len(trees_y))
+    if sparse_output:
+        if store:
+            values = sparse.csr_matrix(GramStore(store, kernel.lmd).gram(
+                kernel, trees_x, trees_y, jobs, tile_size))
+        else:
+            values = _fill_gram(kernel, trees_x, trees_y, symmetric,
+                                _SparseGram(shape), jobs=jobs,
+                                tile_size=tile_size).tocsr()
+        gram = (_expansion(index_x, shape[0]) * values *
+                _expansion(index_y, shape[1]).T).astype(dtype).tocsr()
+        if saveto:
+            sparse.save_npz(saveto, gram)
+        return gram
+    if store:
+        values = GramStore(store, kernel.lmd).gram(kernel, trees_x, trees_y,
+                                                   jobs, tile_size)
+        gram = values[np.ix_(index_x, index_y)].astype(dtype)
+        if saveto:
+            np.save(saveto, gram)
+        return gram
     if saveto:
-        np.save(saveto, gram)
+        if not saveto.endswith('.npy'):
+            saveto += '.npy'
+        signature = _gram_signature(data1, data2, shape, dtype, tile_size,
+                                    kernel.lmd)
+        values, done, log = _open_checkpoint(saveto, shape, dtype, signature)
+    else:
+        values, done, log = np.zeros(shape, dtype=dtype), set(), None
+    try:
+        _fill_gram(kernel, trees_x, trees_y, symmetric, values, done, log,
+                   jobs, tile_size)
+    finally:
+        if log is not None:
+            log.close()
+    if not saveto:
+        return values[np.ix_(index_x, index_y)]
+    gram = open_memmap(saveto, mode='w+', dtype=dtype,
+                       shape=(len(index_x), len(index_y)))
+    for r in range(0, len(index_x), tile_size):
+        gram[r:r + tile_size] = values[index_x[r:r + tile_size]][:, index_y]
+    gram.flush()
+    del values
+    os.remove(saveto + '.tiles.npy')
+    os.remove(saveto + '.done')
     return gram
 
 
-if __name__ == '__main__':
-    gram = get_gram_matrix('./data/rel-trainset.gold', None, 'gram_train.npy')
-    Y = load_labels('./data/rel-train.gold')
-    clf = svm.SVC(kernel='precomputed')
-    clf.fit(gram, Y)
-    test_gram = get_gram_matrix('./data/rel-testset.gold', 'gram_test.npy')
-    hypothesis = clf.predict(test_gram)
+class Nystroem(object):
+    """
+    Low-rank (Nystroem) approximation of a tree kernel: each tree is mapped
+    to features, computed from its kernel values with `n_landmarks`
+    landmark trees only, whose dot products approximate the kernel
+
+    :param selection: 'kmeans++' picks each landmark with a probability
+                      proportional to its squared distance (in the kernel's
+                      feature space) to the closest landmark already picked;
+                      'random' picks them uniformly
+    """
+
+    def __init__(self, kernel, n_landmarks=1000, selection='kmeans++',
+                 seed=0, jobs=1):
+        self.kernel = kernel
+        self.n_landmarks = n_landmarks
+        self.selection = selection
+        self.seed = seed
+        self.jobs = jobs
+        self.landmarks = None
+        self.normalization = None
+
+    def _columns(self, trees, landmarks):
+        """-> kernel values of the trees (rows) with the landmarks"""
+        return _fill_gram(self.kernel, trees, landmarks, False,
+                          np.zeros((len(trees), len(landmarks))),
+                          jobs=self.jobs)
+
+    def _kmeans_plus_plus(self, trees, m, rng):
+        """
+        -> (indices of the landmarks, their kernel columns); the workers
+        are forked once, and each column is split in chunks of the bucket
+        of its landmark (the other values are structural zeros)
+        """
+        global _gram_state
+        buckets = _buckets(trees)
+        _gram_state = (self.kernel, trees, trees, buckets, buckets, False)
+        pool = Pool(self.jobs) if self.jobs > 1 else None
+        try:
+            run = imap if pool is None else pool.imap_unordered
+            diagonal = np.zeros(len(trees))
+            for (i0, i1), values in run(_self_values,
+                                        _chunks(len(trees), TILE_SIZE)):
+                diagonal[i0:i1] = values
+            columns = np.zeros((len(trees), m))
+            chosen = [rng.randint(len(trees))]
+            distances = np.inf
+            for k in range(m):
+                landmark = trees[chosen[k]]
+                if landmark is not None:
+                    rows = buckets[landmark.keys[0]]
+                    tasks = [(chosen[k], i0, i1)
+                             for i0, i1 in _chunks(len(rows), TILE_SIZE)]
+                    for (_, i0, i1), values in run(_landmark_column, tasks):
+                        columns[rows[i0:i1], k] = values
+                distances = np.minimum(distances, diagonal +
+                                       diagonal[chosen[k]] - 2 * columns[:, k])
+                distances[chosen] = 0.0
+                distances = np.maximum(distances, 0.0)
+                if k + 1 == m or distances.sum() <= 0:
+                    break
+                chosen.append(rng.choice(len(trees),
+                                         p=distances / distances.sum()))
+        finally:
+            if pool is not None:
+                pool.terminate()
+            _gram_state = None
+        return chosen, columns[:, :len(chosen)]
+
+    def fit_transform(self, trees):
+        """
+        Pick the landmarks among distinct (compiled) trees
+        -> the features of the trees
+        """
+        rng = np.random.RandomState(self.seed)
+        m = min(self.n_landmarks, len(trees))
+        if self.selection == 'kmeans++':
+            chosen, columns = self._kmeans_plus_plus(trees, m, rng)
+        elif self.selection == 'random':
+            chosen = list(rng.choice(len(trees), m, replace=False))
+            columns = self._columns(trees, [trees[i] for i in chosen])
+        else:
+            raise ValueError("unknown selection: {}".format(self.selection))
+        self.landmarks = [trees[i] for i in chosen]
+        # K_mm^(-1/2), ignoring the null space of duplicate landmarks
+        u, s, v = np.linalg.svd(columns[chosen])
+        s = np.maximum(s, 1e-12)
+        self.normalization = np.dot(u / np.sqrt(s), v)
+        return columns.dot(self.normalization.T)
+
+    def transform(self, trees):
+        """-> the features of the trees (one kernel value per landmark)"""
+        return self._columns(trees, self.landmarks).dot(self.normalization.T)
+
+
+def nystroem_features(train, test, n_landmarks=1000, selection='kmeans++',
+                      jobs=1):
+    """
+    -> (features of the training instances, features of the test
+    instances), from the Nystroem approximation of the tree kernel
+    """
+    kernel = CulottaSorensen()
+    trees_train, index_train = _unique([kernel.compile(x)
+                                        for x in load_instances(train)])
+    approximation = Nystroem(kernel, n_landmarks, selection, jobs=jobs)
+    X_train = approximation.fit_transform(trees_train)[index_train]
+    trees_test, index_test = _unique([kernel.compile(x)
+                                      for x in load_instances(test)])
+    X_test = approximation.transform(trees_test)[index_test]
+    return X_train, X_test
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train and test an SVM with the tree kernel")
+    parser.add_argument('--train', dest='trainset', help="path to the training data",
+                        default='./data/rel-trainset.gold')
+    parser.add_argument('--test', dest='testset', help="path to the test data (with gold labels)",
+                        default='./data/rel-testset.gold')
+    parser.add_argument('--kernel', dest='kernel',
+                        choices=['culotta-sorensen', 'shortest-path',
+                                 'subset-tree'],
+                        help="the tree kernel", default='culotta-sorensen')
+    parser.add_argument('--landmarks', dest='landmarks', type=int,
+                        help="number of landmarks of the Nystroem approximation "
+                             "(0 for the exact gram matrices)",
+                        default=0)
+    parser.add_argument('--selection', dest='selection',
+                        choices=['kmeans++', 'random'],
+                        help="how the landmarks are picked", default='kmeans++')
+    parser.add_argument('--jobs', dest='jobs', type=int,
+                        help="number of processes computing the kernel",
+                        default=1)
+    parser.add_argument('--store', dest='store',
+                        help="folder keeping the kernel values across runs",
+                        default=None)
+    args = parser.parse_args()
+    if args.kernel != 'culotta-sorensen' and \
+            (args.landmarks or args.store or args.jobs != 1):
+        parser.error("--landmarks, --store and --jobs only apply to "
+                     "the culotta-sorensen kernel")
+    Y = load_labels(args.trainset)
+    if args.kernel == 'shortest-path':
+        kernel = ShortestPathKernel()
+        paths = load_paths(args.trainset, kernel)
+        clf = svm.SVC(kernel='precomputed')
+        clf.fit(kernel.gram_matrix(paths), Y)
+        hypothesis = clf.predict(kernel.gram_matrix(
+            load_paths(args.testset, kernel), paths))
+    elif args.kernel == 'subset-tree':
+        kernel = SubsetTreeKernel()
+        trees = load_pets(args.trainset, kernel)
+        clf = svm.SVC(kernel='precomputed')
+        clf.fit(kernel.gram_matrix(trees), Y)
+        hypothesis = clf.predict(kernel.gram_matrix(
+            load_pets(args.testset, kernel), trees))
+    elif args.landmarks:
+        X_train, X_test = nystroem_features(args.trainset, args.testset,
+                                            args.landmarks, args.selection,
+                                            args.jobs)
+        clf = svm.LinearSVC()
+        clf.fit(X_train, Y)
+        hypothesis = clf.predict(X_test)
+    else:
+        gram = get_gram_matrix(args.trainset, None, 'gram_train.npy',
+                               args.jobs, store=args.store)
+        clf = svm.SVC(kernel='precomputed')
+        clf.fit(gram, Y)
+        test_gram = get_gram_matrix(args.testset, args.trainset,
+                                    'gram_test.npy', args.jobs,
+                                    store=args.store)
+        hypothesis = clf.predict(test_gram)
     with open('kernel_based.hyp', 'a') as f:
         for x in hypothesis:
             f.write(x + '\n')
+    precision, recall, f = evaluate(load_labels(args.testset), hypothesis)
+    print "Precision: %.2f\nRecall: %.2f\nF1: %.2f" % \
+        ((precision * 100), (recall * 100), (f * 100))
+
 
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,10 @@
 
 from __future__ import with_statement
 import os
+import hashlib
+from collections import Mapping, OrderedDict
 from document import Document, MentionPair
+from document_cache import DocumentCache
 
 
 """
@@ -11,18 +14,110 @@ Some utilities to fetch useful information from the data
 """
 
 
+class DocumentStore(Mapping):
+    """
+    A lazy mapping from file names (the first 21 characters of the
+    file names under `postagged`) to Document instances. A Document is
+    only parsed the first time it is accessed, and at most
+    `max_documents` documents (or `max_sentences` sentences, counted over
+    all the cached documents) are kept in memory; the least recently
+    used ones are dropped first. `None` means no limit.
+    If `cache_dir` is given, parsed documents are persisted there (see
+    `document_cache.py`) and only re-parsed when their source files change.
+
+    >>> documents = DocumentStore(max_documents=1)
+    >>> len(documents)
+    128
+    >>> print documents['APW20001001.2021.0521'].tagged_sents[1]
+    Egypt-Assad_RB
+    >>> _ = documents['APW20001001.2021.0521']
+    >>> _ = documents['APW20001002.0615.0146']
+    >>> sorted(documents.stats().items())
+    [('cached', 1), ('evictions', 1), ('hits', 1), ('misses', 2)]
+    """
+
+    def __init__(self, postagged='./data/postagged-files',
+                 parsed='./data/parsed-files',
+                 dependency='./data/dep-files',
+                 max_documents=None, max_sentences=None, cache_dir=None):
+        self.postagged = postagged
+        self.parsed = parsed
+        self.dependency = dependency
+        self.max_documents = max_documents
+        self.max_sentences = max_sentences
+        self.cache = DocumentCache(cache_dir) if cache_dir else None
+        self._root_names = dict()
+        for filename in os.listdir(postagged):
+            if filename.endswith('.tag'):
+                root_name, _ = os.path.splitext(filename)
+                self._root_names[root_name[:21]] = root_name
+        self._cache = OrderedDict()
+        self._sentences = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, filename):
+        try:
+            document = self._cache.pop(filename)
+            self.hits += 1
+        except KeyError:
+            document = self._load(filename)
+            self.misses += 1
+            self._sentences += len(document)
+        self._cache[filename] = document
+        self._shrink()
+        return document
+
+    def _load(self, filename):
+        if self.cache is not None:
+            return self.cache.load(self._root_names[filename], self.postagged,
+                                   self.parsed, self.dependency)
+        return Document(self._root_names[filename], self.postagged,
+                        self.parsed, self.dependency)
+
+    def _shrink(self):
+        """Drop the least recently used documents until the limits hold"""
+        while len(self._cache) > 1 and (
+                (self.max_documents is not None and
+                 len(self._cache) > self.max_documents) or
+                (self.max_sentences is not None and
+                 self._sentences > self.max_sentences)):
+            _, document = self._cache.popitem(last=False)
+            self._sentences -= len(document)
+            self.evictions += 1
+
+    def __iter__(self):
+        return iter(self._root_names)
+
+    def __len__(self):
+        return len(self._root_names)
+
+    def __contains__(self, filename):
+        return filename in self._root_names
+
+    def stats(self):
+        """Cache statistics"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'cached': len(self._cache)}
+
+    def clear(self):
+        """Drop all the cached documents"""
+        self._cache.clear()
+        self._sentences = 0
+
+
 def load_documents(postagged='./data/postagged-files',
                    parsed='./data/parsed-files',
-                   dependency='./data/dep-files'):
+                   dependency='./data/dep-files',
+                   max_documents=None, max_sentences=None,
+                   cache_dir='./cache/documents'):
     """
-    Load all the postagged and parsed data into Document instances
+    Get all the postagged and parsed data as lazily loaded Document
+    instances
     """
-    raw_list = [x for x in os.listdir(postagged) if x.endswith('.tag')]
-    d = dict()
-    for filename in raw_list:
-        root_name, _ = os.path.splitext(filename)
-        d[root_name[:21]] = Document(root_name, postagged, parsed, dependency)
-    return d
+    return DocumentStore(postagged, parsed, dependency,
+                         max_documents, max_sentences, cache_dir)
 
 
 def load_mention_pairs(filename):
@@ -32,8 +127,41 @@ def load_mention_pairs(filename):
     return [MentionPair(line) for line in open(filename)]
 
 
+def iter_mention_pairs(filename):
+    """
+    Lazily load mention pairs
+    """
+    with open(filename) as f:
+        for line in f:
+            yield MentionPair(line)
+
+
+def file_hash(filename, sha=None):
+    """ -> the sha1 of the content of a file (updating `sha`, if given) """
+    sha = sha or hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            sha.update(block)
+    return sha
+
+
+def resources_hash(folders):
+    """ -> content hash of the files of some folders (documents, word lists) """
+    sha = hashlib.sha1()
+    for folder in folders:
+        for filename in sorted(os.listdir(folder)):
+            sha.update(filename)
+            file_hash(os.path.join(folder, filename), sha)
+    return sha.hexdigest()
+
+
 def read_lines(data_file):
     """ data file -> lines (lists) """
     with open(data_file, 'r') as f:
         for line in f.readlines():
             yield line
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()